@@ -0,0 +1,730 @@
+"""Benchmarks comparing the optimized capture pipeline against its previous implementations."""
+
+import io
+import os
+import sys
+import time
+import socket
+import subprocess
+import threading
+import queue
+import pickle
+import tracemalloc
+import contextlib
+import numpy as np
+import cv2
+import multiprocessing
+import markerDetection as md
+import yuvConversion as yc
+import frameStore as fs
+import detectionFormat as df
+import clockSync as cs
+import cameraTrigger as ct
+import cameraController as controller
+import simulatedNode as sn
+import mocapSolver as ms
+
+RESOLUTION = (1632, 1232)
+
+def syntheticFrame(resolution=RESOLUTION, seed=0):
+    """Returns a reproducible full resolution BGR frame of random noise."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (resolution[1], resolution[0], 3), dtype="uint8")
+
+def timeIt(function, *args, repeat=10):
+    """Returns the median milliseconds taken by a function call and the call's result."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), result
+
+def peakMemory(function, *args):
+    """Returns the peak MB allocated by a function call."""
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+def report(name, before, after):
+    """Prints the before and after milliseconds of a benchmark."""
+    print("{} : {:.2f} ms -> {:.2f} ms ({:.1f}x)".format(name, before, after, before / after))
+
+def renderMarkerFrame(count=24, resolution=RESOLUTION, seed=0):
+    """
+    Renders a frame of randomly placed, rotated and skewed markers on white.
+
+    Returns:
+        BGR frame, list of (color, pattern, (x, y) center) ground truth tuples.
+    """
+    rng = np.random.default_rng(seed)
+    frame = np.full((resolution[1], resolution[0], 3), 235, dtype="uint8")
+    columns = int(np.ceil(np.sqrt(count * resolution[0] / resolution[1])))
+    cell = resolution[0] // columns
+    truth = []
+    for i in range(count):
+        color = list(sn.COLOR_BGR)[rng.integers(len(sn.COLOR_BGR))]
+        pattern = md.PATTERNS[rng.integers(len(md.PATTERNS))][1]
+        marker = sn.renderMarker(color, pattern)
+        side = marker.shape[0]
+
+        # Random Rotation, Scale & Perspective inside the Marker's Grid Cell
+        center = np.array([(i % columns + 0.5) * cell, (i // columns + 0.5) * cell])
+        radius = cell * rng.uniform(0.22, 0.32)
+        angle = rng.uniform(0, 2 * np.pi) + np.arange(4) * np.pi / 2 + rng.normal(0, 0.06, 4)
+        corners = center + radius * np.sqrt(2) * np.stack((np.cos(angle), np.sin(angle)), axis=1)
+        source = np.array([[0, 0], [side, 0], [side, side], [0, side]], dtype="float32")
+        persp = cv2.getPerspectiveTransform(source, corners.astype("float32"))
+        warped = cv2.warpPerspective(marker, persp, resolution)
+        mask = cv2.warpPerspective(np.full((side, side), 255, dtype="uint8"), persp, resolution)
+        frame[mask > 127] = warped[mask > 127]
+        truth.append((color, pattern, tuple(center)))
+
+    frame = cv2.GaussianBlur(frame, (3, 3), 0)
+    noise = rng.normal(0, 4, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype("uint8"), truth
+
+def identified(markers):
+    """Returns the set of (color, pattern) identifiers found in an identified markers dictionary."""
+    return set((c, p) for c in markers for p in markers[c] if markers[c][p] is not None)
+
+def legacyBuffer2bgr(data, resolution=RESOLUTION):
+    """Previous bytes2yuv, yuv2rgb and cvtColor conversion of cameraController.buffer2bgr."""
+    Y, Uq, Vq = yc.planes(data, resolution)
+    U = np.repeat(np.repeat(Uq, 2, axis=0), 2, axis=1)
+    V = np.repeat(np.repeat(Vq, 2, axis=0), 2, axis=1)
+    YUV = np.dstack((Y, U, V)).astype(float)
+    YUV[:, :, 0] = YUV[:, :, 0] - 16
+    YUV[:, :, 1:] = YUV[:, :, 1:] - 128
+    M = np.array([[1.164,  0.000,  1.596],
+                  [1.164, -0.392, -0.813],
+                  [1.164,  2.017,  0.000]])
+    rgb = YUV.dot(M.T).clip(0, 255).astype(np.uint8)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+## HSV QUANTIZATION ##
+
+def legacyHsvAdjustment(image):
+    """Previous np.place based implementation of markerDetection.hsvAdjustment."""
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    saturation = hsv[:, :, 1]
+    np.place(hsv[:, :, 1], saturation > 64, 255)
+
+    hue = hsv[:, :, 0]
+    np.place(hsv[:, :, 0], np.logical_or(hue < 15, hue > 173), 0)
+    np.place(hsv[:, :, 0], np.logical_and(hue >= 15, hue <= 45), 30)
+    np.place(hsv[:, :, 0], np.logical_and(hue > 45, hue <= 75), 60)
+    np.place(hsv[:, :, 0], np.logical_and(hue > 75, hue <= 105), 90)
+    np.place(hsv[:, :, 0], np.logical_and(hue > 105, hue <= 135), 120)
+    np.place(hsv[:, :, 0], np.logical_and(hue > 135, hue <= 173), 150)
+
+    value = hsv[:, :, 2]
+    np.place(hsv[:, :, 2], value < 85, 0)
+
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+def benchmarkHsvAdjustment():
+    """Per frame cost of HSV quantization on a full resolution frame."""
+    frame = syntheticFrame()
+    before, expected = timeIt(legacyHsvAdjustment, frame)
+    after, result = timeIt(md.hsvAdjustment, frame)
+    if not np.array_equal(expected, result):
+        raise AssertionError("hsvAdjustment output differs from the legacy implementation")
+    report("hsvAdjustment", before, after)
+
+## MARKER BIT SAMPLING ##
+
+def syntheticMarkerCrops(count, size=256, seed=0):
+    """Returns a stack of noisy marker crops built from random 8x8 color bit grids."""
+    rng = np.random.default_rng(seed)
+    bits = rng.integers(0, 2, (count, 8, 8, 3), dtype="uint8") * 200 + 30
+    crops = np.repeat(np.repeat(bits, size // 8, axis=1), size // 8, axis=2)
+    noise = rng.integers(-40, 40, crops.shape)
+    return np.clip(crops + noise, 0, 255).astype("uint8")
+
+def legacyCreateMarkerBinaryMaps(warpedMarker, bitSize=32):
+    """Previous cv2.mean based implementation of markerDetection.createMarkerBinaryMaps."""
+    tag = np.empty([8, 8, 4])
+    for yChunk in range(8):
+        for xChunk in range(8):
+            tag[yChunk, xChunk] = cv2.mean(warpedMarker[(yChunk*bitSize) : ((yChunk+1)*bitSize),
+                                                        (xChunk*bitSize) : ((xChunk+1)*bitSize)])
+
+    cleanTag = np.array(np.delete(tag, 3, 2), dtype="uint8")
+    grayTag = cv2.cvtColor(cleanTag, cv2.COLOR_BGR2GRAY)
+    _, grayBinary = cv2.threshold(grayTag, 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, blueBinary = cv2.threshold(cleanTag[:, :, 0], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, greenBinary = cv2.threshold(cleanTag[:, :, 1], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, redBinary = cv2.threshold(cleanTag[:, :, 2], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    return grayBinary, blueBinary, greenBinary, redBinary
+
+def benchmarkBinaryMaps(count=64):
+    """Per frame cost of sampling marker bits for a frame with many candidates."""
+    crops = syntheticMarkerCrops(count)
+    before, expected = timeIt(lambda: [legacyCreateMarkerBinaryMaps(crop) for crop in crops])
+    after, result = timeIt(md.createMarkerBinaryMapsBatch, crops)
+    for i, maps in enumerate(expected):
+        for channel, legacy in zip(result, maps):
+            if not np.array_equal(channel[i], legacy):
+                raise AssertionError("createMarkerBinaryMapsBatch output differs from the legacy implementation")
+    report("createMarkerBinaryMaps x{}".format(count), before, after)
+
+## PATTERN IDENTIFICATION ##
+
+def syntheticBinaryMaps(count, seed=0):
+    """Returns (gray, blue, green, red) bit array tuples of rotated patterns, noisy patterns and noise."""
+    rng = np.random.default_rng(seed)
+    maps = []
+    for i in range(count):
+        pattern = np.array(md.PATTERNS[i % len(md.PATTERNS)][0], dtype="uint8")
+        channels = [np.rot90(pattern, rng.integers(4)) for _ in range(4)]
+        if i % 3 == 1:
+            channels = [np.bitwise_xor(c, rng.random((8, 8)) < 0.05).astype("uint8") for c in channels]
+        elif i % 3 == 2:
+            channels = [rng.integers(0, 2, (8, 8), dtype="uint8") for _ in range(4)]
+        maps.append(tuple(np.ascontiguousarray(c) for c in channels))
+    return maps
+
+def legacyCheckPattern(mystery):
+    """Previous np.allclose based implementation of markerDetection.checkPattern."""
+    for pattern in md.PATTERNS:
+        if np.allclose(mystery, pattern[0], 0, 0.5):
+            return pattern[1]
+    return False
+
+def legacyFindPattern(grayChannel, redChannel, greenChannel, blueChannel, rot):
+    """Previous implementation of markerDetection.findPattern."""
+    pattern = legacyCheckPattern(grayChannel)
+    if pattern is False:
+        pattern = legacyCheckPattern(np.rot90(redChannel, rot))
+        if pattern is False:
+            pattern = legacyCheckPattern(np.rot90(greenChannel, rot))
+            if pattern is False:
+                pattern = legacyCheckPattern(np.rot90(blueChannel, rot))
+    return pattern
+
+def legacyIdentifyMarker(binaryMaps):
+    """Previous np.rot90 based identification step of markerDetection.identifyMarker."""
+    gray, blue, green, red = binaryMaps
+    isMarker, rotation, gray = md.isAMarker(gray)
+
+    if isMarker is False:
+        isMarker, rotation, red = md.isAMarker(red)
+        if isMarker is False:
+            return None
+
+    pattern = legacyFindPattern(gray, red, green, blue, rotation)
+    if pattern is False:
+        gray = np.rot90(gray)
+        isMarker, newRotation, gray = md.isAMarker(gray)
+        rotation = newRotation + rotation + 1
+        if isMarker is False:
+            isMarker, rotation, red = md.isAMarker(red)
+            if isMarker is False:
+                return None
+        pattern = legacyFindPattern(gray, red, green, blue, rotation)
+
+    return md.findColor(blue, green, red), pattern
+
+def benchmarkIdentification(count=600):
+    """Per marker cost of identifying pattern and color from bit arrays."""
+    maps = syntheticBinaryMaps(count)
+    identify = lambda binaryMaps: md.identifyMarker((None, None, None), binaryMaps)
+    before, expected = timeIt(lambda: [legacyIdentifyMarker(m) for m in maps])
+    after, result = timeIt(lambda: [identify(m) for m in maps])
+    for legacy, marker in zip(expected, result):
+        if (legacy is None) != (marker is None) or (marker is not None and legacy != marker[:2]):
+            raise AssertionError("identifyMarker output differs from the legacy implementation")
+    report("identifyMarker x{}".format(count), before, after)
+
+## CONTOUR GATING ##
+
+def benchmarkContourFilter():
+    """Per frame cost of finding squares in a noisy full resolution frame with and without gating."""
+    contours, hierarchy, _ = md.imageProcessing(syntheticFrame(), withHierarchy=True)
+    contourFilter = md.ContourFilter(counting=True)
+    before, _ = timeIt(md.findSquares, contours, hierarchy, None, repeat=3)
+    after, _ = timeIt(md.findSquares, contours, hierarchy, contourFilter, repeat=3)
+    report("findSquares ({} contours)".format(len(contours)), before, after)
+    contourFilter.reset()
+    md.findSquares(contours, hierarchy, contourFilter)
+    print(contourFilter.report())
+
+## DIRECT TO GRID WARPING ##
+
+def benchmarkGridWarp(frames=4):
+    """Per frame cost of markerID with 256px crops against direct to grid warping."""
+    before = after = 0
+    for seed in range(frames):
+        frame, truth = renderMarkerFrame(seed=seed)
+        cropTime, cropMarkers = timeIt(md.markerID, frame, None, repeat=3)
+        gridTime, gridMarkers = timeIt(md.markerID, frame, md.GRID_SAMPLES, repeat=3)
+        if identified(cropMarkers) != identified(gridMarkers):
+            raise AssertionError("direct to grid warping changed identification on frame {}".format(seed))
+        before += cropTime / frames
+        after += gridTime / frames
+    report("markerID grid x{}".format(md.GRID_SAMPLES), before, after)
+
+## YUV PLANE DETECTION ##
+
+def benchmarkYuvDetection(frames=4):
+    """Per frame cost of buffer to markers, through a BGR frame against directly on the YUV planes."""
+    before = after = 0
+    for seed in range(frames):
+        data = yc.bgrToI420(renderMarkerFrame(seed=seed)[0])
+        bgrTime, bgrMarkers = timeIt(lambda: md.markerID(legacyBuffer2bgr(data)), repeat=3)
+        yuvTime, yuvMarkers = timeIt(lambda: md.markerIDYuv(*yc.planes(data, RESOLUTION)), repeat=3)
+        found = identified(bgrMarkers)
+        print("frame {} : {} identified through BGR, {} on YUV planes, {} in common".format(
+            seed, len(found), len(identified(yuvMarkers)), len(found & identified(yuvMarkers))))
+        before += bgrTime / frames
+        after += yuvTime / frames
+    report("buffer to markerID on YUV planes", before, after)
+
+## I420 CONVERSION ##
+
+def benchmarkConversion():
+    """Per frame cost and peak memory of converting a full resolution I420 buffer to BGR."""
+    data = yc.bgrToI420(syntheticFrame())
+    legacyTime, expected = timeIt(legacyBuffer2bgr, data)
+    for name, native in (("native", True), ("reference", False)):
+        if native and not yc.NATIVE_I420:
+            continue
+        convertTime, result = timeIt(yc.i420ToBgr, data, RESOLUTION, native)
+        difference = np.abs(result.astype(int) - expected).max()
+        report("i420ToBgr {} (max difference {})".format(name, difference), legacyTime, convertTime)
+        print("peak memory : {:.1f} MB -> {:.1f} MB".format(peakMemory(legacyBuffer2bgr, data),
+                                                          peakMemory(yc.i420ToBgr, data, RESOLUTION, native)))
+    if not np.array_equal(yc.i420ToBgr(data, RESOLUTION, False), expected):
+        raise AssertionError("reference i420ToBgr output differs from the legacy conversion")
+
+## FRAME STORE ##
+
+def frameChecksum(frame):
+    """Worker task reading every byte of a frame."""
+    return int(np.frombuffer(frame, dtype=np.uint8)[::4096].sum())
+
+def legacyPoolChecksum(index):
+    """Worker task reading a frame from the Manager list pool."""
+    return frameChecksum(LEGACY_POOL[index])
+
+def storePoolChecksum(index):
+    """Worker task reading a frame from the shared frame store."""
+    return frameChecksum(STORE[index])
+
+def benchmarkFrameStore(frames=48):
+    """Cost of handing a recording to the worker pool through a Manager list against shared memory."""
+    global LEGACY_POOL, STORE
+    data = [yc.bgrToI420(syntheticFrame(seed=seed)) for seed in range(4)]
+    recording = [data[i % len(data)] for i in range(frames)]
+
+    # Manager List Pool
+    start = time.perf_counter()
+    manager = multiprocessing.Manager()
+    LEGACY_POOL = manager.list()
+    for i in range(0, frames, 23):
+        LEGACY_POOL.extend(recording[i:i + 23])
+    legacyFill = time.perf_counter() - start
+    with multiprocessing.Pool() as pool:
+        legacyRead, expected = timeIt(pool.map, legacyPoolChecksum, range(frames), repeat=1)
+    manager.shutdown()
+
+    # Shared Frame Store, allocated before recording and written to during it
+    start = time.perf_counter()
+    STORE = fs.SharedFrameStore(RESOLUTION, frames)
+    allocate = time.perf_counter() - start
+    start = time.perf_counter()
+    for frame in recording:
+        STORE.write(frame)
+    write = (time.perf_counter() - start) / frames
+    with multiprocessing.Pool() as pool:
+        storeRead, result = timeIt(pool.map, storePoolChecksum, range(frames), repeat=1)
+    STORE.close()
+
+    if expected != result:
+        raise AssertionError("frames read from the shared frame store differ")
+    print("memory pool x{} frames after recording : {:.2f} ms -> 0 ms".format(frames, legacyFill * 1000))
+    print("shared frame store : {:.2f} ms to allocate before recording, {:.2f} ms per frame written".format(
+        allocate * 1000, write * 1000))
+    report("worker reads x{} frames".format(frames), legacyRead, storeRead)
+
+def benchmarkMappedStore(frames=96):
+    """Write and worker read cost of a memory-mapped frame store against the shared memory store."""
+    global STORE
+    data = [yc.bgrToI420(syntheticFrame(seed=seed)) for seed in range(4)]
+    timings = {}
+    for store in (fs.SharedFrameStore, fs.MappedFrameStore):
+        STORE = store(RESOLUTION, frames)
+        start = time.perf_counter()
+        for i in range(frames):
+            STORE.write(data[i % len(data)])
+        write = (time.perf_counter() - start) / frames * 1000
+        with multiprocessing.Pool() as pool:
+            read, result = timeIt(pool.map, storePoolChecksum, range(frames), repeat=1)
+        timings[store] = write, read, result
+        if store is fs.MappedFrameStore:
+            print("mapped frame store telemetry : {}".format(STORE.telemetry()))
+        STORE.close()
+
+    shared, mapped = timings[fs.SharedFrameStore], timings[fs.MappedFrameStore]
+    if shared[2] != mapped[2]:
+        raise AssertionError("frames read from the mapped frame store differ")
+    report("write per frame, shared memory -> mapped file", shared[0], mapped[0])
+    report("worker reads x{} frames, shared memory -> mapped file".format(frames), shared[1], mapped[1])
+
+def storeDetection(index):
+    """Worker task detecting markers in a frame of the shared frame store."""
+    return md.markerIDYuv(*yc.planes(STORE[index], RESOLUTION))
+
+def benchmarkStreaming(frames=48, framerates=(12, 96), capacity=16):
+    """Wait after the end of a paced recording for detection after stop_recording against streamed detection."""
+    global STORE
+    data = [yc.bgrToI420(renderMarkerFrame(seed=seed)[0]) for seed in range(4)]
+    recording = [data[i % len(data)] for i in range(frames)]
+
+    def record(store, framerate):
+        start = time.perf_counter()
+        for i, frame in enumerate(recording):
+            time.sleep(max(0, start + i / framerate - time.perf_counter()))
+            store.write(frame)
+
+    # Detection after the Recording
+    STORE = fs.SharedFrameStore(RESOLUTION, frames)
+    record(STORE, max(framerates))
+    start = time.perf_counter()
+    with multiprocessing.Pool() as pool:
+        expected = pool.map(storeDetection, range(frames), chunksize=round(frames / 4))
+        after = time.perf_counter() - start
+    STORE.close()
+
+    # Streamed Detection through the Controller's Buffer, Frames the Workers Fall Behind on Overflow
+    for framerate in framerates:
+        with multiprocessing.Pool() as pool:
+            buffer = controller.StreamingFrameBuffer(RESOLUTION, capacity, pool, frames)
+            try:
+                record(buffer, framerate)
+                printout = io.StringIO()
+                with contextlib.redirect_stdout(printout):
+                    buffer.flush()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    streamed = buffer.collect()
+                stream = time.perf_counter() - start
+            finally:
+                buffer.close()
+
+        if streamed != expected:
+            raise AssertionError("streamed detection differs from detection after recording")
+        telemetry = "Frame Store Telemetry : {:.1f} MB".format(buffer.store.overflowed * fs.frameSize(RESOLUTION) / 2**20)
+        if (telemetry in printout.getvalue()) != (buffer.store.overflowed > 0):
+            raise AssertionError("overflowed frames aren't reported in the frame store telemetry")
+        print("frames held in memory : {} -> {}, {} of {} frames overflowed, {} dropped".format(
+            frames, capacity, buffer.store.overflowed, frames, buffer.store.dropped))
+        report("wait after recording x{} frames at {} fps".format(frames, framerate), after * 1000, stream * 1000)
+
+def benchmarkDetectionFormat(frames=720):
+    """Size and load time of a take's detections pickled against the columnar detection format."""
+    detected = [md.markerID(renderMarkerFrame(seed=seed)[0]) for seed in range(8)]
+    take = [pickle.loads(pickle.dumps(detected[i % len(detected)])) for i in range(frames)]
+    legacy = pickle.dumps(take)
+    columnar = io.BytesIO()
+    df.writeDetections(columnar, take)
+    columnar = columnar.getvalue()
+
+    if df.unpackDetections(*df.readDetections(io.BytesIO(columnar))) != df.unpackDetections(*df.packDetections(take)):
+        raise AssertionError("detections read from the columnar format differ")
+    print("detections x{} frames : {:.1f} kB -> {:.1f} kB ({:.1f}x)".format(
+        frames, len(legacy) / 1024, len(columnar) / 1024, len(legacy) / len(columnar)))
+    report("load arrays", timeIt(lambda: df.packDetections(pickle.loads(legacy)))[0],
+           timeIt(lambda: df.readDetections(io.BytesIO(columnar)))[0])
+    report("load dictionaries", timeIt(pickle.loads, legacy)[0],
+           timeIt(lambda: df.unpackDetections(*df.readDetections(io.BytesIO(columnar))))[0])
+
+def busyFrame(duration):
+    """Worker task standing in for the detection of a frame taking duration seconds."""
+    time.sleep(duration)
+    return duration
+
+def benchmarkScheduling(frames=96, workers=4):
+    """Static chunks of a quarter take against dynamic scheduling when the busy frames are clustered."""
+    durations = [0.002] * frames
+    durations[frames // 2:frames // 2 + frames // 8] = [0.04] * (frames // 8)
+    with multiprocessing.Pool(workers) as pool:
+        static, expected = timeIt(pool.map, busyFrame, durations, round(frames / 4), repeat=3)
+        dynamic, result = timeIt(lambda: list(pool.imap(busyFrame, durations, chunksize=2)), repeat=3)
+    if expected != result:
+        raise AssertionError("dynamically scheduled results are out of order")
+    report("x{} frames with a busy cluster on {} workers".format(frames, workers), static, dynamic)
+
+SESSION = ["ABCD", RESOLUTION[0], RESOLUTION[1], 24, 1, 1600, 2000, "auto", 1.5, 1.5]
+
+def answerSession(inputs, outputs):
+    """Answers a capture session's prompts over line streams, returning the seconds until recording starts and the export line."""
+    start = time.perf_counter()
+    answers = iter(SESSION)
+    prompts = {"Session ID": 1, "Resolution": 2, "Frame Rate": 1, "Max Recording": 1,
+               "ISO": 1, "Shutter Speed": 1, "AWB Mode": 1, "AWB Gains": 2}
+    line = inputs.readline().rstrip()
+    while line != "Record Start":
+        for _ in range(prompts.get(line, 0)):
+            outputs.write("{}\n".format(next(answers)))
+        if line == "Clock Sync":
+            outputs.write("done\n")
+        outputs.flush()
+        line = inputs.readline().rstrip()
+
+    # Start Recording Right Away, Skipping the Clock Measurement
+    outputs.write("{!r}\n".format(time.time()))
+    outputs.flush()
+    ready = time.perf_counter() - start
+    while not line.startswith("Data Exported to"):
+        line = inputs.readline().rstrip()
+    return ready, line
+
+def benchmarkDaemon(sessions=3):
+    """Time until recording starts for a one-shot controller against the warm capture daemon, with the stand-in camera."""
+    controller = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cameraController.py")
+    oneShot = []
+    for _ in range(sessions):
+        process = subprocess.Popen([sys.executable, controller, "--stand-in"], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, universal_newlines=True)
+        oneShot.append(answerSession(process.stdout, process.stdin)[0])
+        process.wait()
+
+    daemon = subprocess.Popen([sys.executable, controller, "--daemon", "--stand-in"], stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    port = int(daemon.stdout.readline().split(" : ")[1])
+    warm = []
+    try:
+        for _ in range(sessions):
+            with socket.create_connection(("127.0.0.1", port)) as connection:
+                with connection.makefile("r") as inputs, connection.makefile("w") as outputs:
+                    warm.append(answerSession(inputs, outputs)[0])
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    report("time until recording starts", np.median(oneShot) * 1000, np.median(warm) * 1000)
+
+class LatencyLine(object):
+    """Line channel delivering every written line in order after a random network latency."""
+    def __init__(self, latency, seed=0):
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        self.sent = queue.Queue()
+        self.delivered = queue.Queue()
+        self.lastDelivery = 0
+        threading.Thread(target=self.deliver, daemon=True).start()
+
+    def deliver(self):
+        while True:
+            delivery, line = self.sent.get()
+            time.sleep(max(0, delivery - time.time()))
+            self.delivered.put(line)
+
+    def write(self, text):
+        for line in text.splitlines(True):
+            self.lastDelivery = max(self.lastDelivery, time.time() + self.rng.uniform(*self.latency))
+            self.sent.put((self.lastDelivery, line))
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return self.delivered.get()
+
+def simulatedTrigger(inputs, outputs, offset, starts, index, scheduled):
+    """Camera node answering a record trigger on a clock offset seconds off, recording the true start time."""
+    clock = lambda: time.time() + offset
+    if scheduled:
+        cs.answerSync(inputs, outputs, clock)
+        cs.waitUntil(float(inputs.readline()), clock)
+    else:
+        time.sleep(float(inputs.readline()))
+    starts[index] = time.time()
+
+def triggerSkew(nodes, latency, scheduled, seed):
+    """Returns the spread in seconds of the true record starts of simulated nodes, and the worst clock offset error."""
+    rng = np.random.default_rng(seed)
+    offsets = rng.uniform(-2, 2, nodes)
+    starts = [None] * nodes
+    cameras = []
+    threads = []
+    for i in range(nodes):
+        camera = ct.remoteCamera.__new__(ct.remoteCamera)
+        camera.i, camera.o, camera.e = LatencyLine(latency, seed * nodes + 2 * i), LatencyLine(latency, seed * nodes + 2 * i + 1), None
+        threads.append(threading.Thread(target=simulatedTrigger, args=(camera.i, camera.o, offsets[i], starts, i, scheduled)))
+        threads[-1].start()
+        cameras.append(camera)
+
+    offsetError = 0
+    if scheduled:
+        for camera, offset in zip(cameras, offsets):
+            camera.syncClock()
+            offsetError = max(offsetError, abs(camera.offset - offset))
+        recordStart = time.time() + 0.2
+        for camera in cameras:
+            camera.send(repr(recordStart + camera.offset))
+    else:
+        timeBase = time.time()
+        for camera in cameras:
+            camera.send(str(0.2 - (time.time() - timeBase)))
+    for thread in threads:
+        thread.join()
+    return max(starts) - min(starts), offsetError
+
+def benchmarkTriggerSync(nodes=4, latency=(0.002, 0.030), takes=5):
+    """Record start skew of the delay trigger against the clock offset compensated trigger over a simulated network."""
+    delayed = [triggerSkew(nodes, latency, False, seed)[0] for seed in range(takes)]
+    scheduled = [triggerSkew(nodes, latency, True, seed) for seed in range(takes)]
+    print("worst clock offset error : {:.2f} ms".format(max(error for _, error in scheduled) * 1000))
+    report("median record start skew of {} nodes, {:.0f}-{:.0f} ms latency".format(nodes, latency[0] * 1000, latency[1] * 1000),
+           np.median(delayed) * 1000, np.median([skew for skew, _ in scheduled]) * 1000)
+
+def syntheticTake(cameras, frames, seed=0):
+    """Returns packed detection arrays of the simulated scene seen by each camera, with pixel noise and missed detections."""
+    rng = np.random.default_rng(seed)
+    takes = []
+    for camera in cameras:
+        points = np.zeros((frames, len(df.MARKER_KEYS), df.POINTS, 2), dtype="float32")
+        valid = np.zeros((frames, len(df.MARKER_KEYS)), dtype=bool)
+        for frame in range(frames):
+            for label, position in sn.markerPositions(frame).items():
+                projection = sn.projectPoint(camera, position, RESOLUTION)
+                if projection is None or rng.random() < 0.1:
+                    continue
+                marker = df.MARKER_INDEX[tuple(label.split())]
+                points[frame, marker, 0] = np.array(projection[0]) + rng.normal(0, 0.5, 2)
+                valid[frame, marker] = True
+        takes.append((points, valid))
+    return takes
+
+def benchmarkSolve(seconds=15, count=3):
+    """Frame by frame pairwise triangulation against pairwise triangulation of the whole take at once."""
+    cameras = [sn.cameraPose(index, count) for index in range(count)]
+    takes = syntheticTake(cameras, seconds * 24)
+    frames = [df.unpackDetections(*take) for take in takes]
+    solveFrames = lambda: [ms.solveFrame(*[(take[i], camera) for take, camera in zip(frames, cameras)])
+                           for i in range(len(frames[0]))]
+    before, expected = timeIt(solveFrames, repeat=1)
+    after, solved = timeIt(lambda: ms.solvedFrames(*ms.solvePairs(*ms.stackTakes(takes), cameras)), repeat=5)
+
+    if [[label for label, point, distance in frame] for frame in expected] != [[label for label, point, distance in frame] for frame in solved]:
+        raise AssertionError("whole take solve found different markers")
+    difference = max(max(np.max(np.abs(np.subtract(a[1], b[1]))), abs(a[2] - b[2]))
+                     for frameA, frameB in zip(expected, solved) for a, b in zip(frameA, frameB))
+    report("solve {} s take x{} cameras (max difference {:.1e} m)".format(seconds, count, difference), before, after)
+
+def benchmarkCameraRays(frames=360, count=12):
+    """Rays cast one detection at a time through pointsOnLine against a cached camera model."""
+    camera = sn.cameraPose(0, 3)
+    pixels = np.random.default_rng(0).uniform(0, 1, (frames, count, 2)) * RESOLUTION
+    castEach = lambda: [ms.pointsOnLine(camera, tuple(pixel / RESOLUTION)) for pixel in pixels.reshape(-1, 2)]
+    before, expected = timeIt(castEach, repeat=3)
+    model = ms.CameraModel.fromTuple(camera)
+    after, rays = timeIt(model.rays, pixels)
+    difference = np.max(np.abs(np.array([end - origin for origin, end in expected]).reshape(rays.shape) - rays))
+    report("rays x{} detections (max difference {:.1e})".format(frames * count, difference), before, after)
+
+def sceneTruth(frames):
+    """Returns a (frames, markers, 3) array of the simulated scene's marker positions, NaN for markers not in the scene."""
+    truth = np.full((frames, len(df.MARKER_KEYS), 3), np.nan)
+    for frame in range(frames):
+        for label, position in sn.markerPositions(frame).items():
+            truth[frame, df.MARKER_INDEX[tuple(label.split())]] = position
+    return truth
+
+def solveError(solve, truth):
+    """Returns the median error in mm of the solved markers of a whole take solve."""
+    points, residuals, solved = solve
+    return np.median(np.linalg.norm(points[solved] - truth[solved], axis=-1)) * 1000
+
+def benchmarkMultiView(seconds=15, counts=(3, 8, 16)):
+    """Pairwise averaged triangulation against one least squares solve over every camera's ray, with a miscalibrated camera."""
+    truth = sceneTruth(seconds * 24)
+    for count in counts:
+        cameras = [sn.cameraPose(index, count) for index in range(count)]
+        points, valid = ms.stackTakes(syntheticTake(cameras, seconds * 24))
+
+        # Some Detections have a NaN Center where the Detector couldn't Find it, see detectionFormat
+        points.reshape(-1, 2)[np.flatnonzero(valid)[::50]] = np.nan
+
+        # The Solve Assumes the First Camera is Turned 0.5 Degrees from where it Really is
+        solveCameras = [cameras[0][:5] + (cameras[0][5] + np.radians(0.5),) + cameras[0][6:]] + cameras[1:]
+        pairwise, pairs = timeIt(ms.solvePairs, points, valid, solveCameras, repeat=3)
+        multiView, views = timeIt(ms.solveSession, points, valid, solveCameras, repeat=3)
+        if not np.array_equal(pairs[2], views[2]):
+            raise AssertionError("least squares solve found different markers, missing centers included")
+        print("x{} cameras median error : pairwise {:.1f} mm, least squares {:.1f} mm".format(
+            count, solveError(pairs, truth), solveError(views, truth)))
+        report("solve {} s take x{} cameras".format(seconds, count), pairwise, multiView)
+
+def benchmarkLensRays(detections=17640):
+    """Rays through the angle of view model against rays undistorted through a lens calibration in one batch."""
+    matrix = np.array([[1300, 0, RESOLUTION[0] / 2 + 7], [0, 1300, RESOLUTION[1] / 2 - 5], [0, 0, 1]], dtype="float64")
+    distortion = np.array([[0.18, -0.45, 0.001, -0.002, 0.3]])
+    pixels = np.random.default_rng(0).uniform(0, 1, (detections, 2)) * RESOLUTION
+    linear = timeIt(ms.CameraModel((0, 0, 0), (0, 0, 0), (1.0856, 0.8517)).rays, pixels)[0]
+    after, rays = timeIt(ms.CameraModel((0, 0, 0), (0, 0, 0), (1.0856, 0.8517), lens=(matrix, distortion)).rays, pixels)
+
+    # Rays Project back onto their Pixels through the Lens, in openCV's Camera Space
+    projected = cv2.projectPoints(rays * (1, -1, -1), np.zeros(3), np.zeros(3), matrix, distortion)[0].reshape(-1, 2)
+    error = np.max(np.linalg.norm(projected - pixels, axis=-1))
+    report("rays x{} detections, angle of view model -> lens calibration (max reprojection error {:.4f} px)".format(
+        detections, error), linear, after)
+
+def benchmarkParallelSolve(seconds=30, count=16, workers=(1, 2, 4)):
+    """Solving a take in the GUI's process against frame ranges solved by pools of worker processes."""
+    cameras = [ms.CameraModel.fromTuple(sn.cameraPose(index, count)) for index in range(count)]
+    takes = syntheticTake([sn.cameraPose(index, count) for index in range(count)], seconds * 24)
+    before, expected = timeIt(ms.solveTake, takes, cameras, repeat=3)
+
+    measured = {}
+    for processes in workers:
+        with multiprocessing.Pool(processes) as pool:
+            measured[processes], result = timeIt(ms.solveParallel, takes, cameras, pool, processes, repeat=3)
+        if result != expected:
+            raise AssertionError("parallel solve differs from the single process solve")
+        report("measured solve {} s take x{} cameras on {} workers".format(seconds, count, processes), before, measured[processes])
+
+    # Amdahl's Law, only solveSession is Split Across Workers, a Single Worker Measures the Hand Off
+    stacked, points = timeIt(ms.stackTakes, takes, repeat=3)
+    session, solved = timeIt(ms.solveSession, *points, cameras, repeat=3)
+    listing, _ = timeIt(ms.solvedFrames, *solved, repeat=3)
+    handOff = max(0.0, measured[workers[0]] - before) if workers[0] == 1 else 0.0
+    print("{} cpus, stack {:.2f} ms + solve {:.2f} ms + list {:.2f} ms + hand off {:.2f} ms".format(
+        os.cpu_count(), stacked, session, listing, handOff))
+    for processes in workers:
+        projected = stacked + listing + handOff + session / processes
+        report("projected solve {} s take x{} cameras on {} cores".format(seconds, count, processes), before, projected)
+
+BENCHMARKS = {
+    'hsv': benchmarkHsvAdjustment,
+    'bits': benchmarkBinaryMaps,
+    'identify': benchmarkIdentification,
+    'contours': benchmarkContourFilter,
+    'grid': benchmarkGridWarp,
+    'yuv': benchmarkYuvDetection,
+    'convert': benchmarkConversion,
+    'store': benchmarkFrameStore,
+    'stream': benchmarkStreaming,
+    'mapped': benchmarkMappedStore,
+    'format': benchmarkDetectionFormat,
+    'schedule': benchmarkScheduling,
+    'daemon': benchmarkDaemon,
+    'sync': benchmarkTriggerSync,
+    'rays': benchmarkCameraRays,
+    'solve': benchmarkSolve,
+    'multiview': benchmarkMultiView,
+    'lens': benchmarkLensRays,
+    'parallel': benchmarkParallelSolve,
+}
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
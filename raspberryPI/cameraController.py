@@ -1,140 +1,220 @@
 import time
 import sys
 import multiprocessing
+import socket
+import signal
+import traceback
 from socket import gethostname
 from functools import partial
-import pickle
 import os
-import picamera
-import numpy as np
-import cv2
 import markerDetection as md
+import yuvConversion as yc
+import frameStore as fs
+import detectionFormat as df
+import resultTransfer as rt
+import clockSync as cs
 import cameraCalibration as cc
 
+# Detect Markers on the Y, U & V Planes instead of a Reconstructed BGR Frame
+YUV_DETECTION = True
+
+# Detect Markers while Recording, Holding at most STREAM_CAPACITY Frames in Memory, Frames the
+# Workers Fall Behind on Overflow to a Memory-Mapped File
+STREAM_DETECTION = True
+STREAM_CAPACITY = 48
+
+# Frames Handed to a Worker at a Time and Seconds Between Progress Lines
+CHUNK_SIZE = 2
+PROGRESS_INTERVAL = 1
+
+# Takes Larger than MEMORY_LIMIT Bytes are Recorded to a Memory-Mapped File instead of RAM
+MEMORY_LIMIT = 512 * 2**20
+
+# Local Port the Capture Daemon Accepts Sessions on
+DAEMON_PORT = 5123
+
+# Name Exported Files are Labeled with, the Master Matches them to its Cameras by it
+HOST = gethostname()
+
 class FrameBuffer(object):
-    def __init__(self, resolution):
-        self.buffer = []
+    def __init__(self, resolution, capacity):
+        if fs.frameSize(resolution) * capacity > MEMORY_LIMIT:
+            self.store = fs.MappedFrameStore(resolution, capacity)
+        else:
+            self.store = fs.SharedFrameStore(resolution, capacity)
         self.resolution = resolution
     
     def __iter__(self):
-        self.iterationCount = -1
-        return self
-    
-    def __next__(self):
-        self.iterationCount += 1
-        if self.iterationCount < self.frameCount:
-            return self.iterationCount
-        raise StopIteration
+        # Iterate over the Store Slots of the Frames Held, a Fresh Iterator each Time as Pool.imap
+        # Iterates in Chunks
+        return (index % self.store.capacity for index in range(self.store.first, self.frameCount))
 
     def write(self, sensorOutput):
-        self.buffer.append(sensorOutput)
+        return self.store.write(sensorOutput)
 
     def flush(self):
         # Estabish Recording Length
-        self.frameCount = len(self.buffer)
+        self.frameCount = self.store.frameCount
         print("Finished Recording : {}".format(self.frameCount))
+        if isinstance(self.store, fs.MappedFrameStore):
+            print("Frame Store Telemetry : {}".format(self.store.telemetry()))
 
-        # Create Shared Memory Pool
+        # Frames were Written Straight into the Shared Memory Pool
         memoryStart = time.time()
-        self.manager = multiprocessing.Manager()
-        i, o = 0, 23
-        self.pool = self.manager.list(self.buffer[i:o])
-        del self.buffer[i:o]
-        while len(self.buffer) > (o + 1):
-            self.pool.extend(self.buffer[i:o])
-            del self.buffer[i:o]
-        self.pool.extend(self.buffer)
-        del self.buffer
+        self.pool = self.store
         memoryTime = time.time() - memoryStart
         print("Finished Creating Memory Pool : {}".format(memoryTime))
     
     def close(self):
-        self.manager.shutdown()
+        self.store.close()
 
-def raw_resolution(splitter=False):
+class StreamingFrameBuffer(object):
     """
-    Round a (width, height) tuple up to the nearest multiple of 32 horizontally
-    and 16 vertically (as this is what the Pi's camera module does for
-    unencoded output).
+    Frame buffer handing every recorded frame to a running worker pool.
 
-    Originally Written by Dave Jones as part of PiCamera
-    """
-    width, height = RESOLUTION
-    if splitter:
-        fwidth = (width + 15) & ~15
-    else:
-        fwidth = (width + 31) & ~31
-    fheight = (height + 15) & ~15
-    return fwidth, fheight
+    Each frame is written to a free slot of a StreamingFrameStore and detected by the pool while
+    the recording continues. The slot is released once its frame is processed, so at most capacity
+    frames are held in memory. Frames arriving while every slot is busy overflow to a
+    memory-mapped store with room for the whole take and are detected once the recording stops.
+    The overflow reports its write telemetry like FrameBuffer's mapped store, showing whether the
+    storage kept up with the camera.
 
-def bytes2yuv(data):
+    When given a stores dictionary, the stores are kept in it after the take and reused by the
+    next take with the same resolution and capacities, sparing the allocation.
     """
-    Converts a bytes object containing YUV data to a `numpy`_ array.
+    def __init__(self, resolution, capacity, workers, overflowCapacity, stores=None):
+        self.keepStore = stores is not None
+        stores = stores if self.keepStore else {}
+        overflow = self.reuseStore(stores, 'overflow', resolution, overflowCapacity)
+        if overflow is None:
+            overflow = stores['overflow'] = fs.MappedFrameStore(resolution, overflowCapacity)
+        store = self.reuseStore(stores, 'streaming', resolution, capacity)
+        if store is None:
+            store = stores['streaming'] = fs.StreamingFrameStore(resolution, capacity, self.submit, overflow)
+        else:
+            store.reset(self.submit, overflow)
+        self.store = store
+        self.overflow = overflow
+        self.resolution = resolution
+        self.task = partial(findMarker, self.store.spec())
+        self.results = []
+        self.workers = workers
 
-    Originally Written by Dave Jones as part of PiCamera
-    """
-    width, height = RESOLUTION
-    fwidth, fheight = raw_resolution()
-    y_len = fwidth * fheight
-    uv_len = (fwidth // 2) * (fheight // 2)
-    if len(data) != (y_len + 2 * uv_len):
-        raise PiCameraValueError(
-            'Incorrect buffer length for resolution %dx%d' % (width, height))
-    # Separate out the Y, U, and V values from the array
-    a = np.frombuffer(data, dtype=np.uint8)
-    Y = a[:y_len].reshape((fheight, fwidth))
-    Uq = a[y_len:-uv_len].reshape((fheight // 2, fwidth // 2))
-    Vq = a[-uv_len:].reshape((fheight // 2, fwidth // 2))
-    # Reshape the values into two dimensions, and double the size of the
-    # U and V values (which only have quarter resolution in YUV4:2:0)
-    U = np.empty_like(Y)
-    V = np.empty_like(Y)
-    U[0::2, 0::2] = Uq
-    U[0::2, 1::2] = Uq
-    U[1::2, 0::2] = Uq
-    U[1::2, 1::2] = Uq
-    V[0::2, 0::2] = Vq
-    V[0::2, 1::2] = Vq
-    V[1::2, 0::2] = Vq
-    V[1::2, 1::2] = Vq
-    # Stack the channels together and crop to the actual resolution
-    return np.dstack((Y, U, V))[:height, :width]
-
-def yuv2rgb(yuv):
+    @staticmethod
+    def reuseStore(stores, key, resolution, capacity):
+        """Returns the kept store under key if it matches the resolution and capacity, closing it otherwise."""
+        store = stores.pop(key, None)
+        if store is not None and (store.resolution, store.capacity) == (resolution, capacity):
+            stores[key] = store
+            return store
+        if store is not None:
+            store.close()
+        return None
+
+    def submit(self, index, slot):
+        if slot is None:
+            self.results.append(None)
+            return
+        if slot >= self.store.capacity:
+            # Overflow Frames Wait for the Recording to Stop, the Workers are Behind Already
+            self.results.append(slot - self.store.capacity)
+            return
+        release = lambda result, slot=slot: self.store.release(slot)
+        self.results.append(self.workers.apply_async(self.task, (slot,), callback=release, error_callback=release))
+
+    def write(self, sensorOutput):
+        return self.store.write(sensorOutput)
+
+    def flush(self):
+        # Estabish Recording Length
+        self.frameCount = self.store.frameCount
+        print("Finished Recording : {}".format(self.frameCount))
+        print("Stream Telemetry : {} overflowed {} dropped".format(self.store.overflowed, self.store.dropped))
+        if self.store.overflowed > 0:
+            print("Frame Store Telemetry : {}".format(self.overflow.telemetry()))
+
+        # Frames were Handed to the Workers as they Arrived
+        print("Finished Creating Memory Pool : {}".format(0))
+
+    def collect(self):
+        """Waits for the workers and returns the detection results in recording order."""
+        overflowTask = partial(findMarker, self.overflow.spec())
+        pending = [self.workers.apply_async(overflowTask, (result,)) if isinstance(result, int) else result
+                   for result in self.results]
+        results = (md.organizeMarkerIDs([]) if result is None else result.get() for result in pending)
+        return collectResults(results, self.frameCount)
+
+    def close(self):
+        if not self.keepStore:
+            self.store.close()
+            self.overflow.close()
+
+def collectResults(results, total, interval=PROGRESS_INTERVAL):
     """
-    Originally Written by Dave Jones as part of PiCamera
+    Collects worker results in order, printing progress lines for the master as they arrive.
+
+    Args:
+        results: iterable of worker results in frame order.
+        total (int): number of results expected.
+        interval (float): minimum seconds between progress lines.
+
+    Returns:
+        List of results.
     """
-    # Apply the standard biases
-    YUV = yuv.astype(float)
-    YUV[:, :, 0]  = YUV[:, :, 0]  - 16  # Offset Y by 16
-    YUV[:, :, 1:] = YUV[:, :, 1:] - 128 # Offset UV by 128
-    # YUV conversion matrix from ITU-R BT.601 version (SDTV)
-    #              Y       U       V
-    M = np.array([[1.164,  0.000,  1.596],    # R
-                [1.164, -0.392, -0.813],    # G
-                [1.164,  2.017,  0.000]])   # B
-    # Calculate the dot product with the matrix to produce RGB output,
-    # clamp the results to byte range and convert to bytes
-    rgb = YUV.dot(M.T).clip(0, 255).astype(np.uint8)
-    return rgb
-
-def buffer2bgr(frame):
+    collected = []
+    start = lastReport = time.time()
+    for result in results:
+        collected.append(result)
+        now = time.time()
+        if now - lastReport >= interval or len(collected) == total:
+            rate = len(collected) / max(now - start, 1e-6)
+            print("Processing Progress : {} {} {:.1f}".format(len(collected), total, rate), flush=True)
+            lastReport = now
+    return collected
+
+def buffer2bgr(frame, resolution):
     """Reads frame from the buffer and returns it as an openCV BGR Image."""
-    yuvImage = bytes2yuv(frame)
-    rgbImage = yuv2rgb(yuvImage)
-    image = cv2.cvtColor(rgbImage, cv2.COLOR_RGB2BGR)
-    return image
+    return yc.i420ToBgr(frame, resolution)
 
-def findMarker(bufferIndex):
+def buffer2planes(frame, resolution):
+    """Reads frame from the buffer and returns zero-copy Y, U and V plane views cropped to the resolution."""
+    return yc.planes(frame, resolution)
+
+def findMarker(spec, slot):
     """Multiprocessing Core for Marker Identification"""
-    image = buffer2bgr(f.pool[bufferIndex])
+    store = fs.attachStore(spec)
+    frame = store.slot(slot)
+    if YUV_DETECTION:
+        return md.markerIDYuv(*buffer2planes(frame, store.resolution))
+    image = buffer2bgr(frame, store.resolution)
     return md.markerID(image)
 
-def findCorners(bufferIndex, pattern):
-    image = buffer2bgr(f.pool[bufferIndex])
+def findCorners(spec, slot, pattern):
+    store = fs.attachStore(spec)
+    image = buffer2bgr(store.slot(slot), store.resolution)
     return cc.detectCorners(image, pattern)
 
-if __name__ == "__main__":
+def openCamera(standIn=False):
+    """Returns the Pi's camera, or a stand-in camera recording synthetic frames."""
+    if standIn:
+        import standInCamera
+        return standInCamera.StandInCamera()
+    import picamera
+    return picamera.PiCamera()
+
+def captureSession(camera, workers, stores=None):
+    """
+    Runs a capture session prompted for over stdin and stdout.
+
+    Reads the session settings, records a take with the camera, detects markers or calibration
+    corners in it with the worker pool and exports the results.
+
+    Args:
+        camera: open PiCamera or StandInCamera.
+        workers: multiprocessing pool the frames are processed with.
+        stores: dictionary keeping the streaming frame store between sessions, the store is
+            closed after the session if None.
+    """
     print("Session ID")
     sessionID = input()
 
@@ -161,62 +241,125 @@ if __name__ == "__main__":
 
 
     # Camera Setup
-    camera = picamera.PiCamera()
     camera.resolution = RESOLUTION
     camera.framerate = FRAMERATE
     camera.iso = ISO
     camera.shutter_speed = SHUTTER_SPEED
     camera.awb_mode = AWB_MODE
     camera.awb_gains = AWB_GAINS
-    
-    f = FrameBuffer(RESOLUTION)
 
-    # Establish Scyned Record Start
-    print("Record Delay")
-    recordDelay = float(input())
-    time.sleep(recordDelay)
+    streaming = STREAM_DETECTION and len(sessionID) == 4
+    if streaming:
+        f = StreamingFrameBuffer(RESOLUTION, STREAM_CAPACITY, workers, (MAX_RECORDING + 1) * FRAMERATE, stores)
+    else:
+        f = FrameBuffer(RESOLUTION, (MAX_RECORDING + 1) * FRAMERATE)
 
-    # Recording
-    camera.start_recording(f, 'yuv')
     try:
-        camera.wait_recording(MAX_RECORDING)
-        camera.stop_recording()
-    except KeyboardInterrupt:
-        camera.stop_recording()
-    camera.close()
+        # Establish Scyned Record Start at a Time Scheduled on this Clock
+        cs.answerSync()
+        print("Record Start")
+        recordStart = float(input())
+        cs.waitUntil(recordStart)
+        recordSkew = time.time() - recordStart
 
-    # Time Tracking
-    multiStart = time.time()
+        # Recording
+        camera.start_recording(f, 'yuv')
+        print("Record Skew : {}".format(recordSkew), flush=True)
+        try:
+            camera.wait_recording(MAX_RECORDING)
+            camera.stop_recording()
+        except KeyboardInterrupt:
+            camera.stop_recording()
 
-    # Multiprocessing
-    pool = multiprocessing.Pool()
-    if len(sessionID) == 4:
-        mocap = pool.map(findMarker, f, chunksize=round(f.frameCount / 4))
-    else:
-        s = sessionID.split("-")
-        patternSize = (int(s[0]), int(s[1]))
-        detectCorners = partial(findCorners, pattern=patternSize)
-        lens = pool.map(detectCorners, f, chunksize=round(f.frameCount / 4))
-        imageSize = cc.getImageSize(buffer2bgr(f.pool[0]))
-        matrix, distortion, fov = cc.cameraCalibration(lens, 3.674, 2.76, patternSize[0], patternSize[1], imageSize)
-    
-    pool.close()
-    f.close()
+        # Time Tracking
+        multiStart = time.time()
+
+        # Multiprocessing
+        if streaming:
+            mocap = f.collect()
+        elif len(sessionID) == 4:
+            detectMarkers = partial(findMarker, f.store.spec())
+            mocap = collectResults(workers.imap(detectMarkers, f, chunksize=CHUNK_SIZE), f.frameCount)
+        else:
+            s = sessionID.split("-")
+            patternSize = (int(s[0]), int(s[1]))
+            detectCorners = partial(findCorners, f.store.spec(), pattern=patternSize)
+            lens = collectResults(workers.imap(detectCorners, f, chunksize=CHUNK_SIZE), f.frameCount)
+            imageSize = cc.getImageSize(buffer2bgr(f.pool[f.store.first], RESOLUTION))
+            matrix, distortion, fov = cc.cameraCalibration(lens, 3.674, 2.76, patternSize[0], patternSize[1], imageSize)
+    finally:
+        f.close()
 
     # Report Time Tracking
     multiTime = time.time() - multiStart
     print("Multi Core Processing Finished : {}".format(multiTime))
 
     # Export Data
-    host = gethostname()
     if len(sessionID) == 4:
-        filename = "{}_{}.mocap".format(host, sessionID)
+        filename = "{}_{}.mocap".format(HOST, sessionID)
 
-        with open(filename, "wb") as pik:
-            pickle.dump(mocap, pik)
+        with open(filename, "wb") as data:
+            df.writeDetections(data, mocap)
     else:
-        filename = "{}_{}.calibration".format(host, s[2])
+        filename = "{}_{}.calibration".format(HOST, s[2])
         cc.exportCalibration(filename, matrix, distortion, fov)
         filename += ".npz"
 
     print("Data Exported to : {}".format(os.path.join(os.getcwd(), filename)))
+    print("Data Payload : {}".format(rt.encodePayload(filename)), flush=True)
+
+def serve(camera, workers, port=DAEMON_PORT):
+    """
+    Runs capture sessions for connections to a local socket until interrupted.
+
+    The camera stays open and the worker pool warm between sessions, so a session starts recording
+    without paying for the interpreter, imports, camera and pool startup. Each connection speaks
+    the same line protocol as a one-shot session over stdin and stdout.
+
+    Args:
+        camera: open PiCamera or StandInCamera.
+        workers: multiprocessing pool the frames are processed with.
+        port (int): localhost port to listen on.
+    """
+    server = socket.create_server(("127.0.0.1", port))
+    print("Capture Daemon Listening : {}".format(port), flush=True)
+    stores = {}
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile("r") as inputs, connection.makefile("w") as outputs:
+                stdin, stdout = sys.stdin, sys.stdout
+                sys.stdin, sys.stdout = inputs, outputs
+                try:
+                    captureSession(camera, workers, stores)
+                except Exception:
+                    traceback.print_exc()
+                    # Workers may Still Hold Slots of a Failed Take
+                    for store in stores.values():
+                        store.close()
+                    stores.clear()
+                finally:
+                    sys.stdin, sys.stdout = stdin, stdout
+    finally:
+        server.close()
+        for store in stores.values():
+            store.close()
+
+if __name__ == "__main__":
+    # Start the Detection Workers before the Camera so they don't Inherit its State
+    workers = multiprocessing.Pool()
+    camera = openCamera(standIn="--stand-in" in sys.argv)
+
+    # Clean up the Camera, Workers and Frame Stores when Stopped as a Service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if "--daemon" in sys.argv:
+            serve(camera, workers)
+        else:
+            captureSession(camera, workers)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        camera.close()
+        workers.close()
+        workers.join()
@@ -2,129 +2,58 @@ import time
 import sys
 import multiprocessing
 from socket import gethostname
-import pickle
 import os
 import picamera
-import numpy as np
-import cv2
 import markerDetection as md
+import yuvConversion as yc
+import frameStore as fs
+import detectionFormat as df
+import resultTransfer as rt
+import clockSync as cs
+
+# Detect Markers on the Y, U & V Planes instead of a Reconstructed BGR Frame
+YUV_DETECTION = True
+
+# Frames Handed to a Worker at a Time
+CHUNK_SIZE = 2
 
 class FrameBuffer(object):
-    def __init__(self, resolution):
-        self.buffer = []
+    def __init__(self, resolution, capacity):
+        self.store = fs.SharedFrameStore(resolution, capacity)
         self.resolution = resolution
     
     def __iter__(self):
-        self.iterationCount = -1
-        return self
-    
-    def __next__(self):
-        self.iterationCount += 1
-        if self.iterationCount < self.frameCount:
-            return self.iterationCount
-        raise StopIteration
+        return iter(range(self.store.first, self.frameCount))
 
     def write(self, sensorOutput):
-        self.buffer.append(sensorOutput)
+        return self.store.write(sensorOutput)
 
     def flush(self):
         # Estabish Recording Length
-        self.frameCount = len(self.buffer)
+        self.frameCount = self.store.frameCount
         print("Finished Recording : {}".format(self.frameCount))
 
-        # Create Shared Memory Pool
+        # Frames were Written Straight into the Shared Memory Pool
         memoryStart = time.time()
-        self.manager = multiprocessing.Manager()
-        i, o = 0, 23
-        self.pool = self.manager.list(self.buffer[i:o])
-        del self.buffer[i:o]
-        while len(self.buffer) > (o + 1):
-            self.pool.extend(self.buffer[i:o])
-            del self.buffer[i:o]
-        self.pool.extend(self.buffer)
-        del self.buffer
+        self.pool = self.store
         memoryTime = time.time() - memoryStart
         print("Finished Creating Memory Pool : {}".format(memoryTime))
     
     def close(self):
-        self.manager.shutdown()
-
-def raw_resolution(splitter=False):
-    """
-    Round a (width, height) tuple up to the nearest multiple of 32 horizontally
-    and 16 vertically (as this is what the Pi's camera module does for
-    unencoded output).
-
-    Originally Written by Dave Jones as part of PiCamera
-    """
-    width, height = RESOLUTION
-    if splitter:
-        fwidth = (width + 15) & ~15
-    else:
-        fwidth = (width + 31) & ~31
-    fheight = (height + 15) & ~15
-    return fwidth, fheight
-
-def bytes2yuv(data):
-    """
-    Converts a bytes object containing YUV data to a `numpy`_ array.
-
-    Originally Written by Dave Jones as part of PiCamera
-    """
-    width, height = RESOLUTION
-    fwidth, fheight = raw_resolution()
-    y_len = fwidth * fheight
-    uv_len = (fwidth // 2) * (fheight // 2)
-    if len(data) != (y_len + 2 * uv_len):
-        raise PiCameraValueError(
-            'Incorrect buffer length for resolution %dx%d' % (width, height))
-    # Separate out the Y, U, and V values from the array
-    a = np.frombuffer(data, dtype=np.uint8)
-    Y = a[:y_len].reshape((fheight, fwidth))
-    Uq = a[y_len:-uv_len].reshape((fheight // 2, fwidth // 2))
-    Vq = a[-uv_len:].reshape((fheight // 2, fwidth // 2))
-    # Reshape the values into two dimensions, and double the size of the
-    # U and V values (which only have quarter resolution in YUV4:2:0)
-    U = np.empty_like(Y)
-    V = np.empty_like(Y)
-    U[0::2, 0::2] = Uq
-    U[0::2, 1::2] = Uq
-    U[1::2, 0::2] = Uq
-    U[1::2, 1::2] = Uq
-    V[0::2, 0::2] = Vq
-    V[0::2, 1::2] = Vq
-    V[1::2, 0::2] = Vq
-    V[1::2, 1::2] = Vq
-    # Stack the channels together and crop to the actual resolution
-    return np.dstack((Y, U, V))[:height, :width]
-
-def yuv2rgb(yuv):
-    """
-    Originally Written by Dave Jones as part of PiCamera
-    """
-    # Apply the standard biases
-    YUV = yuv.astype(float)
-    YUV[:, :, 0]  = YUV[:, :, 0]  - 16  # Offset Y by 16
-    YUV[:, :, 1:] = YUV[:, :, 1:] - 128 # Offset UV by 128
-    # YUV conversion matrix from ITU-R BT.601 version (SDTV)
-    #              Y       U       V
-    M = np.array([[1.164,  0.000,  1.596],    # R
-                [1.164, -0.392, -0.813],    # G
-                [1.164,  2.017,  0.000]])   # B
-    # Calculate the dot product with the matrix to produce RGB output,
-    # clamp the results to byte range and convert to bytes
-    rgb = YUV.dot(M.T).clip(0, 255).astype(np.uint8)
-    return rgb
+        self.store.close()
 
 def buffer2bgr(frame):
     """Reads frame from the buffer and returns it as an openCV BGR Image."""
-    yuvImage = bytes2yuv(frame)
-    rgbImage = yuv2rgb(yuvImage)
-    image = cv2.cvtColor(rgbImage, cv2.COLOR_RGB2BGR)
-    return image
+    return yc.i420ToBgr(frame, RESOLUTION)
+
+def buffer2planes(frame):
+    """Reads frame from the buffer and returns zero-copy Y, U and V plane views cropped to the resolution."""
+    return yc.planes(frame, RESOLUTION)
 
 def findMarker(bufferIndex):
     """Multiprocessing Core for Marker Identification"""
+    if YUV_DETECTION:
+        return md.markerIDYuv(*buffer2planes(f.pool[bufferIndex]))
     image = buffer2bgr(f.pool[bufferIndex])
     return md.markerID(image)
 
@@ -163,12 +92,14 @@ if __name__ == "__main__":
     camera.awb_mode = AWB_MODE
     camera.awb_gains = AWB_GAINS
     
-    f = FrameBuffer(RESOLUTION)
+    f = FrameBuffer(RESOLUTION, 1)
 
-    # Establish Scyned Record Start
-    print("Record Delay")
-    recordDelay = float(input())
-    time.sleep(recordDelay)
+    # Establish Scyned Record Start at a Time Scheduled on this Clock
+    cs.answerSync()
+    print("Record Start")
+    recordStart = float(input())
+    cs.waitUntil(recordStart)
+    print("Record Skew : {}".format(time.time() - recordStart), flush=True)
 
     # Capture Still
     camera.capture(f, 'yuv')
@@ -179,7 +110,7 @@ if __name__ == "__main__":
 
     # Multiprocessing
     pool = multiprocessing.Pool()
-    mocap = pool.map(findMarker, f, chunksize=round(f.frameCount / 4))
+    mocap = pool.map(findMarker, f, chunksize=CHUNK_SIZE)
     pool.close()
     f.close()
 
@@ -191,6 +122,7 @@ if __name__ == "__main__":
     host = gethostname()
     filename = "{}_{}.mocap".format(host, sessionID)
 
-    with open(filename, "wb") as pik:
-        pickle.dump(mocap, pik)
+    with open(filename, "wb") as data:
+        df.writeDetections(data, mocap)
     print("Data Exported to : {}".format(os.path.join(os.getcwd(), filename)))
+    print("Data Payload : {}".format(rt.encodePayload(filename)), flush=True)
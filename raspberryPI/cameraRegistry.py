@@ -0,0 +1,116 @@
+"""Registry of the rig's cameras loaded from a config file, with a pool of reusable SSH connections."""
+
+import os
+import json
+import threading
+import paramiko
+
+# Camera Config Shipped next to the Master Scripts
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cameras.json")
+
+# Seconds Between Keepalive Packets on Idle Connections
+KEEPALIVE = 15
+
+class CameraRegistry(object):
+    """
+    Cameras of the rig and where their results are stored, as listed in a JSON config file.
+
+    The config holds the storage directory, default SSH credentials and a list of cameras, each
+    with its host name and IP address and optionally its own username and password.
+
+    Args:
+        path: path of the config file.
+    """
+    def __init__(self, path=CONFIG):
+        with open(path) as config:
+            settings = json.load(config)
+        self.storage = settings['storage']
+        self.cameras = []
+        for camera in settings['cameras']:
+            entry = {'username': settings.get('username', "pi"), 'password': settings.get('password')}
+            entry.update(camera)
+            self.cameras.append(entry)
+
+    @property
+    def ips(self):
+        return [camera['ip'] for camera in self.cameras]
+
+    @property
+    def hosts(self):
+        return [camera['host'] for camera in self.cameras]
+
+    def credentials(self, ip):
+        """Returns the (username, password) a camera is logged into with."""
+        for camera in self.cameras:
+            if camera['ip'] == ip:
+                return camera['username'], camera['password']
+        raise KeyError("{} isn't a registered camera".format(ip))
+
+class ConnectionPool(object):
+    """
+    Authenticated SSH connections to the registered cameras, kept open between sessions.
+
+    Connections are health checked before being handed out and reconnected if they were dropped,
+    so back to back captures open new channels on a live transport instead of repeating the SSH
+    handshake. Connections to different cameras are opened concurrently.
+
+    Args:
+        registry: CameraRegistry the cameras' credentials are looked up in.
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.clients = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def hostLock(self, ip):
+        with self.lock:
+            return self.locks.setdefault(ip, threading.Lock())
+
+    def healthy(self, client):
+        """Returns whether a connection is still alive, probing it with an ignored packet."""
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, OSError):
+            return False
+        return True
+
+    def connect(self, ip):
+        """Opens a new authenticated connection to a camera."""
+        username, password = self.registry.credentials(ip)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(ip, username=username, password=password)
+        client.get_transport().set_keepalive(KEEPALIVE)
+        return client
+
+    def client(self, ip):
+        """Returns a live connection to a camera, reusing the pooled connection when it's healthy."""
+        with self.hostLock(ip):
+            client = self.clients.get(ip)
+            if client is not None and not self.healthy(client):
+                client.close()
+                client = None
+            if client is None:
+                client = self.connect(ip)
+                self.clients[ip] = client
+            return client
+
+    def health(self):
+        """Returns whether each pooled connection is alive, by camera IP."""
+        return {ip: self.healthy(client) for ip, client in list(self.clients.items())}
+
+    def discard(self, ip):
+        """Closes and forgets a camera's connection, e.g. once the camera is shut down."""
+        with self.hostLock(ip):
+            client = self.clients.pop(ip, None)
+            if client is not None:
+                client.close()
+
+    def close(self):
+        """Closes every pooled connection."""
+        for ip in list(self.clients):
+            self.discard(ip)
@@ -1,15 +1,20 @@
-import paramiko
 import time
 import random
 import pickle
 import os
 import threading
+import concurrent.futures
+from functools import partial
+import resultTransfer as rt
+import clockSync as cs
+import cameraRegistry as cr
 
-IP = ["192.168.1.113", "192.168.1.115", "192.168.1.114"]
-HOST = ["blueTriangle", "greenTriangle", "redY"]
-STORAGE = r"F:\mocapMath\Sandbox\rpi"
-# IP = ["10.10.10.2", "10.10.10.3", "10.10.10.4", "10.10.10.5"]
-# HOST = ["blueTriangle", "greenTriangle", "redY", "cyanY"]
+# Cameras are Listed in cameras.json, Connections to them are Kept Open Between Sessions
+REGISTRY = cr.CameraRegistry()
+POOL = cr.ConnectionPool(REGISTRY)
+IP = REGISTRY.ips
+HOST = REGISTRY.hosts
+STORAGE = REGISTRY.storage
 
 RESOLUTION = (1632, 1232)
 FRAMERATE = 24
@@ -19,6 +24,16 @@ SHUTTER_SPEED = 2000
 AWB_MODE = 'auto'
 AWB_GAINS = (1.5, 1.5)
 
+# Run Video Captures through the Warm Capture Daemon on each Pi (cameraController.py --daemon)
+DAEMON = False
+DAEMON_PORT = 5123
+
+# Seconds Between Scheduling the Record Start and the Start
+START_MARGIN = 1
+
+# Labels of the Telemetry Printouts Cameras Send after Recording
+TELEMETRY = ["Stream Telemetry", "Frame Store Telemetry"]
+
 def generateSession():
     """Generates a Random 4 Digit Hex"""
     randomInt = random.randint(4096, 65535)
@@ -27,12 +42,14 @@ def generateSession():
 
 class remoteCamera():
     def __init__(self, ipAdress, still=False, command=None):
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(ipAdress, username="pi", password="mocapMath")
+        self.ssh = POOL.client(ipAdress)
 
         if command is None:
-            if not still:
+            if not still and DAEMON:
+                # Tunnel to the Daemon's Local Socket instead of Starting a Controller
+                channel = self.ssh.get_transport().open_channel("direct-tcpip", ("127.0.0.1", DAEMON_PORT), ("127.0.0.1", 0))
+                self.i, self.o, self.e = channel.makefile("w"), channel.makefile("r"), None
+            elif not still:
                 self.i, self.o, self.e = self.ssh.exec_command("cd /home/pi/Documents; python3 cameraController.py")
             else:
                 self.i, self.o, self.e = self.ssh.exec_command("cd /home/pi/Documents; python3 cameraController_Still.py")
@@ -51,11 +68,12 @@ class remoteCamera():
         if check == checksum:
             return True
         else:
-            print(self.e.readlines())
+            if self.e is not None:
+                print(self.e.readlines())
             raise Exception
     
-    def get(self):
-        """Get printout from remote camera and return the value after ' : '."""
+    def getLabeled(self):
+        """Get printout from remote camera and return the label before and the value after ' : '."""
         payload = self.o.readline()
     
         # Refuse Empty Lines
@@ -64,20 +82,107 @@ class remoteCamera():
         
         payload = payload.rstrip()
         payload = payload.split(" : ")
-        return payload[1]
+        return payload[0], payload[1]
+
+    def get(self):
+        """Get printout from remote camera and return the value after ' : '."""
+        return self.getLabeled()[1]
+
+    def getReporting(self, reports):
+        """Get printout from remote camera like get, first passing the values of printouts labeled by a key of reports to its function."""
+        label, value = self.getLabeled()
+        while label in reports:
+            reports[label](value)
+            label, value = self.getLabeled()
+        return value
+
+    def getWithProgress(self, report, reports=None):
+        """Get printout from remote camera like getReporting, passing (done, total, rate) of progress printouts to report."""
+        def progress(value):
+            done, total, rate = value.split()
+            report(int(done), int(total), float(rate))
+        return self.getReporting(dict(reports or {}, **{"Processing Progress": progress}))
     
     def send(self, payload):
         """Send payload as input string to remote client."""
         self.i.write("{}\n".format(payload))
         self.i.flush()
     
+    def syncClock(self, pings=cs.SYNC_PINGS):
+        """Measures the remote camera's clock offset and round trip delay with NTP style ping exchanges."""
+        self.hold("Clock Sync")
+        samples = []
+        for _ in range(pings):
+            sent = time.time()
+            self.send("ping")
+            received, answered = (float(t) for t in self.get().split())
+            samples.append((sent, received, answered, time.time()))
+        self.send("done")
+        self.offset, self.delay = cs.estimateOffset(samples)
+        return self.offset, self.delay
+
+    def getPayload(self, localpath):
+        """Get a result file pushed by the remote camera down its output and store it at localpath."""
+        return rt.decodePayload(self.get(), localpath)
+
     def getFile(self, remotepath, localpath):
         """Get file from remote client at remotepath and store it at localpath."""
-        sftp = self.ssh.open_sftp()
-        sftp.get(remotepath, localpath)
+        with self.ssh.open_sftp() as sftp:
+            sftp.get(remotepath, localpath)
+
+    def close(self):
+        """Closes the session's channel, leaving the pooled connection open for the next session."""
+        self.o.channel.close()
+
+def armCamera(client, sessionID, still=False, resolution=(1632, 1232), fps=24, max_recording=15, iso=1600, shutter=2000, awb_mode='auto', awb_gains=(1.5, 1.5), connect=remoteCamera):
+    """Connects to a remote camera, sends the session settings and measures its clock, returning the connection waiting for the record start."""
+    connection = connect(client, still)
+    connection.hold("Session ID")
+    connection.send(sessionID)
+    connection.hold("Resolution")
+    connection.send(resolution[0])
+    connection.send(resolution[1])
+    connection.hold("Frame Rate")
+    connection.send(fps)
+    connection.hold("Max Recording")
+    connection.send(max_recording)
+    connection.hold("ISO")
+    connection.send(iso)
+    connection.hold("Shutter Speed")
+    connection.send(shutter)
+    connection.hold("AWB Mode")
+    connection.send(awb_mode)
+    connection.hold("AWB Gains")
+    connection.send(awb_gains[0])
+    connection.send(awb_gains[1])
+
+    # Prepare to Start Recording
+    connection.syncClock()
+    connection.hold("Record Start")
+    return connection
+
+def reportProgress(host, done, total, rate):
+    print("Processed {} of {} Frames at {} fps on {}".format(done, total, rate, host))
+
+def reportTelemetry(host, label, value):
+    print("{} on {} : {}".format(label, host, value))
+
+def retrieveTake(camera, host, workspace):
+    """Follows a remote camera's processing telemetry and retrieves its data file once exported."""
+    reports = {label: partial(reportTelemetry, host, label) for label in TELEMETRY}
+    print("Allocated Shared Memory in {} seconds on {}".format(camera.getReporting(reports), host))
+    processingTime = camera.getWithProgress(partial(reportProgress, host), reports)
+    print("Multi Core Processing Completed in {} seconds on {}".format(processingTime, host))
 
-def remoteCapture(sessionID, gui, still=False, ip=-1, resolution=(1632, 1232), fps=24, max_recording=15, iso=1600, shutter=2000, awb_mode='auto', awb_gains=(1.5, 1.5)):
-    """Triggers remote capture and processing on connected hosts."""
+    # The Data File Follows its Path down the Open Channel
+    dataPath = camera.get()
+    dataFile = os.path.basename(dataPath)
+    dataLocal = os.path.join(workspace, dataFile)
+    camera.getPayload(dataLocal)
+    print("Recieved {}".format(dataFile))
+
+def remoteCapture(sessionID, gui, still=False, ip=-1, resolution=(1632, 1232), fps=24, max_recording=15, iso=1600, shutter=2000, awb_mode='auto', awb_gains=(1.5, 1.5), connect=remoteCamera):
+    """Triggers remote capture and processing on connected hosts, connecting to each with connect(ip, still)."""
 
     progress = gui[0]
     timer = gui[1]
@@ -98,75 +203,51 @@ def remoteCapture(sessionID, gui, still=False, ip=-1, resolution=(1632, 1232), f
         ips = IP
         hosts = HOST
 
-    # Establish Connections
-    CAMERAS = []
-    for client in ips:
-        connection = remoteCamera(client, still)
-        connection.hold("Session ID")
-        connection.send(sessionID)
-        connection.hold("Resolution")
-        connection.send(resolution[0])
-        connection.send(resolution[1])
-        connection.hold("Frame Rate")
-        connection.send(fps)
-        connection.hold("Max Recording")
-        connection.send(max_recording)
-        connection.hold("ISO")
-        connection.send(iso)
-        connection.hold("Shutter Speed")
-        connection.send(shutter)
-        connection.hold("AWB Mode")
-        connection.send(awb_mode)
-        connection.hold("AWB Gains")
-        connection.send(awb_gains[0])
-        connection.send(awb_gains[1])
-        CAMERAS.append(connection)
+    # Every Camera is Followed by its Own Thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ips)) as executor:
 
-    # Prepare to Start Recording
-    for camera in CAMERAS:
-        camera.hold("Record Delay")
-
-    # Sync Camera Record Starts
-    timeUntilStart = 1
-    timeBase = time.time()
-    for camera in CAMERAS:
-        camera.send(str(timeUntilStart - (time.time() - timeBase)))
-    holdTime = timeUntilStart - (time.time() - timeBase)
-    time.sleep(holdTime)
-    print("Recording Started on Remote Cameras")
-
-    # Start Recording Timer
-    timeThread = threading.Thread(target=statusCounter, args=(timer,))
-    timeThread.start()
-
-    # Get Telemetry
-    for i, camera in enumerate(CAMERAS):
-        print("Recorded {} Frames on {}".format(camera.get(), hosts[i]))
-
-    # End Recording Timer / Start Processing Timer
-    killer = True
-    timeThread.join()
-    killer = False
-    progress.advance()
-    timer.reset()
-    timeThread = threading.Thread(target=statusCounter, args=(timer,))
-    timeThread.start()
-
-    # Get Processing Telemetry
-    for i, camera in enumerate(CAMERAS):
-        print("Allocated Shared Memory in {} seconds on {}".format(camera.get(), hosts[i]))
-    for i, camera in enumerate(CAMERAS):
-        print("Multi Core Processing Completed in {} seconds on {}".format(camera.get(), hosts[i]))
-
-    # Retrieve Data
-    os.mkdir(os.path.join(STORAGE, sessionID))
-    workspace = os.path.join(STORAGE, sessionID)
-    for camera in CAMERAS:
-        dataPath = camera.get()
-        dataFile = os.path.basename(dataPath)
-        dataLocal = os.path.join(workspace, dataFile)
-        camera.getFile(dataPath, dataLocal)
-        print("Recieved {}".format(dataFile))
+        # Establish Connections
+        arm = partial(armCamera, sessionID=sessionID, still=still, resolution=resolution, fps=fps, max_recording=max_recording,
+                      iso=iso, shutter=shutter, awb_mode=awb_mode, awb_gains=awb_gains, connect=connect)
+        CAMERAS = list(executor.map(arm, ips))
+
+        # Schedule One Record Start, Translated to each Camera's Clock
+        recordStart = time.time() + START_MARGIN
+        for camera in CAMERAS:
+            camera.send(repr(recordStart + camera.offset))
+        time.sleep(max(0, recordStart - time.time()))
+        print("Recording Started on Remote Cameras")
+
+        # Start Recording Timer
+        timeThread = threading.Thread(target=statusCounter, args=(timer,))
+        timeThread.start()
+
+        # Get Telemetry
+        for camera, host in zip(CAMERAS, hosts):
+            skew = float(camera.get())
+            print("Recording Started {:.1f} ms after the Scheduled Start (Clock Offset {:.1f} ms +/- {:.1f} ms) on {}".format(
+                skew * 1000, camera.offset * 1000, camera.delay * 500, host))
+        recorded = {executor.submit(camera.get): host for camera, host in zip(CAMERAS, hosts)}
+        for future in concurrent.futures.as_completed(recorded):
+            print("Recorded {} Frames on {}".format(future.result(), recorded[future]))
+
+        # End Recording Timer / Start Processing Timer
+        killer = True
+        timeThread.join()
+        killer = False
+        progress.advance()
+        timer.reset()
+        timeThread = threading.Thread(target=statusCounter, args=(timer,))
+        timeThread.start()
+
+        # Get Processing Telemetry and Retrieve Data
+        os.mkdir(os.path.join(STORAGE, sessionID))
+        workspace = os.path.join(STORAGE, sessionID)
+        retrievals = [executor.submit(retrieveTake, camera, host, workspace) for camera, host in zip(CAMERAS, hosts)]
+        for retrieval in retrievals:
+            retrieval.result()
+        for camera in CAMERAS:
+            camera.close()
     
     # End Processing Timer
     killer = True
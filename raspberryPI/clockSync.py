@@ -0,0 +1,59 @@
+"""NTP style clock offset measurement and scheduled starts for synchronizing remote cameras."""
+
+import sys
+import time
+
+# Ping Exchanges per Clock Measurement
+SYNC_PINGS = 32
+
+def answerSync(inputs=None, outputs=None, clock=time.time):
+    """
+    Answers the master's clock sync pings until it sends 'done', on the remote camera.
+
+    Every ping is answered with the times it was received and answered on this node's clock.
+
+    Args:
+        inputs: file the pings are read from, stdin by default.
+        outputs: file the answers are written to, stdout by default.
+        clock: function returning this node's time in seconds.
+    """
+    inputs = sys.stdin if inputs is None else inputs
+    outputs = sys.stdout if outputs is None else outputs
+    outputs.write("Clock Sync\n")
+    outputs.flush()
+    while True:
+        ping = inputs.readline()
+        received = clock()
+        if ping.rstrip() == "done":
+            return
+        outputs.write("Clock : {!r} {!r}\n".format(float(received), float(clock())))
+        outputs.flush()
+
+def estimateOffset(samples):
+    """
+    Estimates a remote clock's offset from ping exchanges, trusting the exchange with the least delay.
+
+    Args:
+        samples: list of (sent, received, answered, returned) times of each ping. The ping is sent
+            and its answer returned on the local clock, received and answered on the remote clock.
+
+    Returns:
+        offset: seconds the remote clock is ahead of the local clock.
+        delay: round trip network delay of the exchange, the offset is accurate to half of it.
+    """
+    estimates = []
+    for sent, received, answered, returned in samples:
+        offset = ((received - sent) + (answered - returned)) / 2
+        delay = (returned - sent) - (answered - received)
+        estimates.append((delay, offset))
+    delay, offset = min(estimates)
+    return offset, delay
+
+def waitUntil(timestamp, clock=time.time, spin=0.002):
+    """Sleeps until the clock reaches timestamp, spinning for the last moments to wake up on time."""
+    while True:
+        remaining = timestamp - clock()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep(remaining - spin)
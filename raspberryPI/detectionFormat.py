@@ -0,0 +1,105 @@
+"""Columnar storage of per-frame marker detections, replacing pickled marker dictionaries."""
+
+import pickle
+import zipfile
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# Detections String ID Constants, as in markerDetection
+COLOR_ID = ['red', 'yellow', 'green', 'cyan', 'blue', 'magenta', False]
+PATTERN_ID = ['triangle', 'square', 'circle', 'slash', 'line', 'y', False]
+
+# Every (color, pattern) Slot of an Organized Marker Dictionary, in Column Order
+MARKER_KEYS = [(color, pattern) for color in COLOR_ID for pattern in PATTERN_ID]
+MARKER_INDEX = {key: i for i, key in enumerate(MARKER_KEYS)}
+
+# Points Stored per Marker, the Center followed by the 4 Corners
+POINTS = 5
+
+def packDetections(frames):
+    """
+    Packs organized marker dictionaries into dense arrays.
+
+    Args:
+        frames: list of organized marker dictionaries, one per frame.
+
+    Returns:
+        points: (frames, 49, 5, 2) float32 NumPy array of marker centers and corners, NaN centers
+            where a marker's center couldn't be found.
+        valid: (frames, 49) boolean NumPy array, True where the marker was detected.
+    """
+    points = np.zeros((len(frames), len(MARKER_KEYS), POINTS, 2), dtype="float32")
+    valid = np.zeros((len(frames), len(MARKER_KEYS)), dtype=bool)
+    for f, frame in enumerate(frames):
+        for m, (color, pattern) in enumerate(MARKER_KEYS):
+            detection = frame[color][pattern]
+            if detection is None:
+                continue
+            center, corners = detection
+            valid[f, m] = True
+            points[f, m, 0] = np.nan if center is None else center
+            points[f, m, 1:] = corners
+    return points, valid
+
+def emptyFrame():
+    """Returns an organized marker dictionary without detections, as markerDetection.createEmptyMarkerDictionary."""
+    return {color: {pattern: None for pattern in PATTERN_ID} for color in COLOR_ID}
+
+def unpackDetections(points, valid):
+    """Returns the list of organized marker dictionaries stored in packed detection arrays."""
+    frames = [emptyFrame() for _ in range(len(valid))]
+    detected = np.nonzero(valid)
+    centers = points[detected][:, 0].astype(float)
+    corners = points[detected][:, 1:].astype("int32").tolist()
+    missing = np.isnan(centers[:, 0]).tolist()
+    for f, m, center, quad, noCenter in zip(*detected, centers.tolist(), corners, missing):
+        color, pattern = MARKER_KEYS[m]
+        frames[f][color][pattern] = (None if noCenter else tuple(center), quad)
+    return frames
+
+def writeDetections(file, frames):
+    """
+    Writes detections to a compressed .npz file.
+
+    Args:
+        file: path or writable binary file object.
+        frames: list of organized marker dictionaries, or a (points, valid) tuple of packed arrays.
+    """
+    points, valid = packDetections(frames) if isinstance(frames, list) else frames
+    np.savez_compressed(file, version=np.array(FORMAT_VERSION), points=points,
+                        valid=np.packbits(valid, axis=1), markers=np.array(MARKER_KEYS, dtype=str))
+
+def readDetections(file):
+    """
+    Reads packed detection arrays from a detection file.
+
+    Args:
+        file: path or readable binary file object of an .npz detection file.
+
+    Returns:
+        (points, valid) tuple of packed detection arrays, see packDetections.
+    """
+    with np.load(file) as data:
+        version = int(data['version'])
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported detection format version {}".format(version))
+        if data['markers'].tolist() != np.array(MARKER_KEYS, dtype=str).tolist():
+            raise ValueError("detection file markers don't match the marker IDs")
+        points = data['points']
+        valid = np.unpackbits(data['valid'], axis=1, count=len(MARKER_KEYS)).astype(bool)
+    return points, valid
+
+def loadDetectionArrays(path):
+    """Returns packed detection arrays from a detection file or a legacy pickled .mocap file."""
+    if zipfile.is_zipfile(path):
+        return readDetections(path)
+    with open(path, "rb") as binary:
+        return packDetections(pickle.load(binary))
+
+def loadDetections(path):
+    """Returns the list of organized marker dictionaries from a detection file or a legacy pickled .mocap file."""
+    if zipfile.is_zipfile(path):
+        return unpackDetections(*readDetections(path))
+    with open(path, "rb") as binary:
+        return pickle.load(binary)
@@ -0,0 +1,281 @@
+"""Preallocated camera frame stores shared between the recording and marker detection processes."""
+
+import os
+import time
+import queue
+import tempfile
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import yuvConversion as yc
+
+# Store this Process is Attached to, by Name
+ATTACHED = {}
+
+# Start the Shared Memory Tracker before any Worker Pool is Forked, so Workers Share it instead of
+# Starting their Own and Reporting the Stores they Attached to as Leaked, Windows has no Tracker
+if os.name == 'posix':
+    resource_tracker.ensure_running()
+
+def frameSize(resolution):
+    """Returns the byte length of a padded I420 frame at the given resolution."""
+    fwidth, fheight = yc.rawResolution(resolution)
+    return fwidth * fheight * 3 // 2
+
+class SharedFrameStore(object):
+    """
+    Ring buffer of camera frames in shared memory.
+
+    The camera output is written straight into preallocated frame slots and worker processes read
+    zero-copy NumPy views of the slots by frame index. Once more than capacity frames are written
+    the oldest frames are overwritten.
+
+    Args:
+        resolution: (width, height) of the recorded frames.
+        capacity (int): number of frame slots.
+        name: name of an existing store's shared memory to attach to instead of allocating.
+        frameCount (int): frames already written to an attached store.
+    """
+    def __init__(self, resolution, capacity, name=None, frameCount=0):
+        self.resolution = resolution
+        self.frameSize = frameSize(resolution)
+        self.capacity = capacity
+        self.owner = name is None
+        self.frames = self.openFrames(name)
+        self.frameCount = frameCount
+        self.offset = 0
+        self.slotIndex = None
+        self.slotFrame = None
+
+    def openFrames(self, name):
+        """Allocates or attaches the shared memory and returns the (capacity, frameSize) frame slots."""
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.frameSize * self.capacity)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        frames = np.ndarray((self.capacity, self.frameSize), dtype=np.uint8, buffer=self.memory.buf)
+        if self.owner:
+            frames.reshape(-1)[::4096] = 0 # fault in every page before recording starts
+        return frames
+
+    @property
+    def name(self):
+        """Name other processes attach to the store's shared memory with."""
+        return self.memory.name
+
+    def spec(self):
+        """Returns a picklable description other processes attach to the store with, see attachStore."""
+        return (SharedFrameStore, self.name, self.resolution, self.capacity)
+
+    @property
+    def first(self):
+        """Index of the oldest frame still held in the store."""
+        return max(0, self.frameCount - self.capacity)
+
+    def nextSlot(self):
+        """Returns the slot the next frame is written to, or None to drop the frame."""
+        return self.frameCount % self.capacity
+
+    def frameComplete(self, index, slot):
+        """Called once a frame has been completely written to its slot."""
+        pass
+
+    def write(self, sensorOutput):
+        """Copies camera output into the frame slots, completing a frame every frameSize bytes."""
+        data = np.frombuffer(sensorOutput, dtype=np.uint8)
+        while len(data):
+            if self.offset == 0:
+                self.slotIndex = self.nextSlot()
+                self.slotFrame = None if self.slotIndex is None else self.slot(self.slotIndex)
+            chunk = min(len(data), self.frameSize - self.offset)
+            if self.slotFrame is not None:
+                self.copy(data[:chunk])
+            data = data[chunk:]
+            self.offset += chunk
+            if self.offset == self.frameSize:
+                self.offset = 0
+                self.frameComplete(self.frameCount, self.slotIndex)
+                self.frameCount += 1
+        return len(sensorOutput)
+
+    def copy(self, chunk):
+        """Copies a chunk of camera output into the slot being written at the current offset."""
+        self.slotFrame[self.offset:self.offset + len(chunk)] = chunk
+
+    def slot(self, slot):
+        """Returns a zero-copy uint8 view of a frame slot."""
+        return self.frames[slot]
+
+    def __len__(self):
+        return self.frameCount - self.first
+
+    def __getitem__(self, index):
+        """Returns a zero-copy uint8 view of a frame by its index in the recording."""
+        if not self.first <= index < self.frameCount:
+            raise IndexError("frame {} isn't held in the store".format(index))
+        return self.frames[index % self.capacity]
+
+    def close(self):
+        """Detaches from the shared memory, freeing it if this store allocated it."""
+        del self.frames
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+class MappedFrameStore(SharedFrameStore):
+    """
+    Ring buffer of camera frames in a preallocated memory-mapped file.
+
+    Frames are written to the page cache and spilled to local storage by the kernel, so the length
+    of a take is limited by free disk space rather than RAM. Worker processes attach to the file by
+    path and read zero-copy views as with the SharedFrameStore. Write telemetry is collected to show
+    when the storage can't keep up with the camera.
+
+    Args:
+        resolution: (width, height) of the recorded frames.
+        capacity (int): number of frame slots.
+        name: path of an existing store's file to attach to instead of allocating.
+        frameCount (int): frames already written to an attached store.
+        directory: directory the file is allocated in, the system temporary directory by default.
+    """
+    def __init__(self, resolution, capacity, name=None, frameCount=0, directory=None):
+        self.directory = directory
+        super().__init__(resolution, capacity, name, frameCount)
+        self.resetTelemetry()
+
+    def openFrames(self, name):
+        if self.owner:
+            handle, name = tempfile.mkstemp(suffix=".frames", dir=self.directory)
+            try:
+                os.posix_fallocate(handle, 0, self.frameSize * self.capacity) # reserve the blocks before recording
+            finally:
+                os.close(handle)
+        self.path = name
+        return np.memmap(name, dtype=np.uint8, mode="r+", shape=(self.capacity, self.frameSize))
+
+    @property
+    def name(self):
+        """Path other processes attach to the store's file with."""
+        return self.path
+
+    def spec(self):
+        return (MappedFrameStore, self.name, self.resolution, self.capacity)
+
+    def write(self, sensorOutput):
+        start = time.perf_counter()
+        written = super().write(sensorOutput)
+        self.recordWrite(written, time.perf_counter() - start)
+        return written
+
+    def recordWrite(self, written, duration):
+        """Adds a write of written bytes taking duration seconds to the telemetry."""
+        self.bytesWritten += written
+        self.writeTime += duration
+        self.slowestWrite = max(self.slowestWrite, duration)
+
+    def resetTelemetry(self):
+        """Forgets the writes recorded so far, so a reused store reports each take on its own."""
+        self.bytesWritten = 0
+        self.writeTime = 0
+        self.slowestWrite = 0
+
+    def throughput(self):
+        """Returns the write throughput in MB/s, stalls while the kernel writes back to storage included."""
+        if self.writeTime == 0:
+            return 0
+        return self.bytesWritten / self.writeTime / 2**20
+
+    def telemetry(self):
+        """Returns a summary of the bytes written, the write throughput and the slowest write."""
+        return "{:.1f} MB at {:.1f} MB/s, slowest write {:.1f} ms".format(
+            self.bytesWritten / 2**20, self.throughput(), self.slowestWrite * 1000)
+
+    def close(self):
+        """Unmaps the file, deleting it if this store allocated it."""
+        del self.frames
+        if self.owner:
+            os.remove(self.path)
+
+class StreamingFrameStore(SharedFrameStore):
+    """
+    Shared frame store handing each frame off as soon as it is recorded.
+
+    Frames are written to whichever slot is free and passed to onFrame(index, slot). The slot stays
+    reserved until released, so memory use is bounded by the capacity. Frames arriving while every
+    slot is reserved are written to the overflow store instead, passed to onFrame with the slot
+    capacity + their index in the overflow store. Only once the overflow store is full too, or
+    without one, are frames dropped and passed to onFrame with a slot of None. Writes to a
+    MappedFrameStore overflow are recorded in its telemetry.
+
+    Args:
+        resolution: (width, height) of the recorded frames.
+        capacity (int): number of frame slots.
+        onFrame: callback receiving the index and slot of every recorded frame.
+        overflow: frame store, usually a MappedFrameStore, taking the frames that find no free slot.
+    """
+    def __init__(self, resolution, capacity, onFrame, overflow=None):
+        super().__init__(resolution, capacity)
+        self.reset(onFrame, overflow)
+
+    def reset(self, onFrame, overflow=None):
+        """Forgets the recorded frames so the store records another take, handing its frames to onFrame."""
+        self.onFrame = onFrame
+        self.overflow = overflow
+        if isinstance(overflow, MappedFrameStore):
+            overflow.resetTelemetry()
+        self.frameCount = 0
+        self.offset = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self.free = queue.Queue()
+        for slot in range(self.capacity):
+            self.free.put(slot)
+
+    def nextSlot(self):
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            pass
+        if self.overflow is not None and self.overflowed < self.overflow.capacity:
+            self.overflowed += 1
+            return self.capacity + self.overflowed - 1
+        self.dropped += 1
+        return None
+
+    def copy(self, chunk):
+        if self.slotIndex < self.capacity or not isinstance(self.overflow, MappedFrameStore):
+            return super().copy(chunk)
+        # Time Writes to the Overflow, they Show whether the Storage Keeps Up with the Camera
+        start = time.perf_counter()
+        super().copy(chunk)
+        self.overflow.recordWrite(len(chunk), time.perf_counter() - start)
+
+    def slot(self, slot):
+        """Returns a zero-copy uint8 view of a frame slot, slots past the capacity are in the overflow store."""
+        if slot >= self.capacity:
+            return self.overflow.slot(slot - self.capacity)
+        return self.frames[slot]
+
+    def frameComplete(self, index, slot):
+        self.onFrame(index, slot)
+
+    def release(self, slot):
+        """Returns a slot to the store once its frame has been processed."""
+        self.free.put(slot)
+
+def attachStore(spec):
+    """
+    Returns this process's attachment to a frame store, detaching from any store attached before.
+
+    Long-running worker processes serve one take after another, so only the store of the current
+    take is kept attached.
+
+    Args:
+        spec: description of the store returned by its spec method.
+    """
+    storeType, name, resolution, capacity = spec
+    if name not in ATTACHED:
+        for store in ATTACHED.values():
+            store.close()
+        ATTACHED.clear()
+        ATTACHED[name] = storeType(resolution, capacity, name=name)
+    return ATTACHED[name]
@@ -0,0 +1,221 @@
+"""End-to-end load harness capturing takes with rigs of simulated camera nodes run on this machine."""
+
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import threading
+import contextlib
+import numpy as np
+import detectionFormat as df
+import cameraTrigger as ct
+import simulatedNode as sn
+import mocapSolver as solver
+
+# Rig Sizes and Take Lengths in Seconds Swept by Default
+CAMERA_COUNTS = (2, 4, 8, 16, 32)
+TAKE_SECONDS = (2, 8)
+
+FRAMERATE = 24
+
+# Seconds Between Memory Samples of the Nodes
+MEMORY_INTERVAL = 0.1
+
+NODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulatedNode.py")
+
+class LocalCamera(ct.remoteCamera):
+    """Connection to a simulated node over its stdin and stdout pipes in place of an SSH session."""
+    def __init__(self, process):
+        self.process = process
+        self.i, self.o, self.e = process.stdin, process.stdout, process.stderr
+
+    def close(self):
+        self.i.close()
+
+class Stages(object):
+    """Stand-in for the capture GUI's progress bar and timer, timestamping the capture stages."""
+    def __init__(self):
+        self.marks = []
+
+    def advance(self):
+        self.marks.append(time.time())
+
+    def addSecond(self):
+        pass
+
+    def reset(self):
+        pass
+
+def launchNodes(count, directory, resolution):
+    """
+    Starts a rig of simulated nodes, each in its own working directory.
+
+    Returns once every node has rendered its frames and waits for a session, so the take measures
+    a warm rig rather than the node startup.
+
+    Args:
+        count (int): number of nodes.
+        directory: directory the node working directories are created in.
+        resolution: (width, height) the nodes render their frames at.
+
+    Returns:
+        List of node processes.
+    """
+    nodes = []
+    for index in range(count):
+        workdir = os.path.join(directory, "node{}".format(index))
+        os.mkdir(workdir)
+        os.symlink(os.path.abspath("markerArrays"), os.path.join(workdir, "markerArrays"))
+        nodes.append(subprocess.Popen([sys.executable, NODE, str(index), str(count), str(resolution[0]), str(resolution[1])],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      universal_newlines=True, cwd=workdir))
+    for node in nodes:
+        ready = node.stderr.readline()
+        if not ready.startswith("Simulated Camera Ready"):
+            raise RuntimeError("simulated node failed to start: " + ready + node.stderr.read())
+    return nodes
+
+def processTree(pid):
+    """Returns the pids of a process and all of its descendants still running."""
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir("/proc/{}/task".format(parent)):
+                with open("/proc/{}/task/{}/children".format(parent, task)) as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return pids
+
+def proportionalMemory(pids):
+    """Returns the summed proportional set size of processes in MB, shared memory split between its users."""
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/{}/smaps_rollup".format(pid)) as rollup:
+                for line in rollup:
+                    if line.startswith("Pss:"):
+                        total += int(line.split()[1])
+                        break
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total / 2**10
+
+class MemoryMonitor(threading.Thread):
+    """Samples the memory of node process trees until stopped, keeping the peak in MB."""
+    def __init__(self, pids, interval=MEMORY_INTERVAL):
+        super().__init__()
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            pids = [child for pid in self.pids for child in processTree(pid)]
+            self.peak = max(self.peak, proportionalMemory(pids))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+def solveError(solved):
+    """
+    Compares a solved take to the simulated scene.
+
+    Returns:
+        Fraction of the scene's markers solved over all frames, median error of the solved markers in mm.
+    """
+    errors = []
+    for frame, markers in enumerate(solved):
+        truth = sn.markerPositions(frame)
+        for label, point, distance in markers:
+            if label in truth:
+                errors.append(np.linalg.norm(np.array(point) - truth[label]))
+    coverage = len(errors) / max(1, len(solved) * len(sn.SCENE_MARKERS))
+    return coverage, np.median(errors) * 1000 if errors else float("nan")
+
+def streamTelemetry(printout):
+    """Returns the frames overflowed to storage and dropped by every camera, from the master's printout of a take."""
+    overflowed = dropped = 0
+    for line in printout.splitlines():
+        if line.startswith("Stream Telemetry on "):
+            counts = line.split(" : ")[1].split()
+            overflowed += int(counts[0])
+            dropped += int(counts[2])
+    return overflowed, dropped
+
+def runTake(count, seconds, resolution=ct.RESOLUTION):
+    """
+    Captures, retrieves and solves a take with a rig of simulated nodes through remoteCapture.
+
+    Args:
+        count (int): number of simulated nodes.
+        seconds (int): length of the take.
+        resolution: (width, height) of the recording.
+
+    Returns:
+        Dictionary of the stage times in seconds, processed frames per second, frames overflowed to
+        storage and dropped, peak node memory in MB, fraction of markers solved and median solve
+        error in mm.
+    """
+    directory = tempfile.mkdtemp()
+    nodes = launchNodes(count, directory, resolution)
+    try:
+        ct.IP = list(range(count))
+        ct.HOST = ["simulated{}".format(index) for index in range(count)]
+        ct.STORAGE = directory
+        monitor = MemoryMonitor([node.pid for node in nodes])
+        monitor.start()
+
+        # Capture through the Master's Own Orchestration, Quieting its Printouts
+        stages = Stages()
+        sessionID = ct.generateSession()
+        connect = lambda client, still: LocalCamera(nodes[client])
+        start = time.time()
+        printout = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(printout):
+                workspace = ct.remoteCapture(sessionID, (stages, stages), resolution=resolution, fps=FRAMERATE,
+                                             max_recording=seconds, connect=connect)
+        finally:
+            peak = monitor.stop()
+        recorded, retrieved = stages.marks
+        overflowed, dropped = streamTelemetry(printout.getvalue())
+
+        # Solve the Retrieved Detections
+        takes = [df.loadDetectionArrays(os.path.join(workspace, "{}_{}.mocap".format(host, sessionID))) for host in ct.HOST]
+        cameras = [sn.cameraPose(index, count) for index in range(count)]
+        solveStart = time.time()
+        solved = solver.solveTake(takes, cameras)
+        solveTime = time.time() - solveStart
+        coverage, error = solveError(solved)
+
+        # Dropped Frames are Stored as Frames without Markers, they Don't Count as Processed
+        processed = sum(len(valid) for points, valid in takes) - dropped
+        return {'capture': recorded - start, 'results': retrieved - recorded, 'solve': solveTime,
+                'total': time.time() - start, 'fps': processed / (retrieved - start), 'overflowed': overflowed,
+                'dropped': dropped, 'memory': peak, 'coverage': coverage, 'error': error}
+    finally:
+        for node in nodes:
+            if node.poll() is None:
+                node.kill()
+            node.wait()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    # loadHarness.py [cameras,...] [seconds,...]
+    counts = [int(count) for count in sys.argv[1].split(",")] if len(sys.argv) > 1 else CAMERA_COUNTS
+    lengths = [int(seconds) for seconds in sys.argv[2].split(",")] if len(sys.argv) > 2 else TAKE_SECONDS
+    for seconds in lengths:
+        for count in counts:
+            take = runTake(count, seconds)
+            print("{} cameras, {} s : captured in {:.2f} s, results {:.2f} s after recording, solved in {:.2f} s, "
+                  "{:.2f} s total, {:.1f} frames/s ({} overflowed, {} dropped), peak node memory {:.0f} MB, "
+                  "{:.0%} markers solved, median error {:.1f} mm".format(
+                      count, seconds, take['capture'], take['results'], take['solve'], take['total'], take['fps'],
+                      take['overflowed'], take['dropped'], take['memory'], take['coverage'], take['error']))
@@ -5,9 +5,8 @@ import os
 import sys
 import cv2
 import numpy as np
-from shapely.geometry.point import Point
-from shapely.geometry.polygon import Polygon
-from shapely.geometry import LineString
+import quadGeometry as qg
+import yuvConversion as yc
  
 # File Management
 def resource_path(relative_path):
@@ -40,17 +39,95 @@ TRIANGLE = (importPattern("markerArrays/triangle.txt"), "triangle")
 Y = (importPattern("markerArrays/y.txt"), "y")
 PATTERNS = (CIRCLE, LINE, SLASH, SQUARE, TRIANGLE, Y)
  
+# Marker Bit Samples per Side when Warping Directly to the Bit Grid
+GRID_SAMPLES = 4
+ 
 # Detections String ID Constants
 COLOR_ID = ['red', 'yellow', 'green', 'cyan', 'blue', 'magenta', False]
 PATTERN_ID = ['triangle', 'square', 'circle', 'slash', 'line', 'y', False]
  
+# Packed Pattern Codes
+ROTATION_INDEX = np.array([np.rot90(np.arange(64).reshape(8, 8), rot).ravel() for rot in range(4)])
+
+def bitMask(bits):
+    """Returns the 64-bit code with the given (row, column) bits set, most significant bit first."""
+    mask = 0
+    for row, column in bits:
+        mask |= 1 << (63 - (row * 8 + column))
+    return mask
+
+BORDER_MASK = bitMask([(r, c) for r in range(8) for c in range(8) if r in (0, 7) or c in (0, 7)])
+ORIENTATION_MASK = bitMask([(1, 1), (1, 2), (2, 1), (5, 6)])
+ORIENTATION_BITS = bitMask([(5, 6)])
+
+def rotationCodes(binaries):
+    """
+   Packs every quarter rotation of 8x8 bit arrays into 64-bit integer codes.
+
+   Args:
+       binaries: (..., 8, 8) NumPy bit array.
+
+   Returns:
+       (..., 4) uint64 NumPy array where [..., rot] is the code of np.rot90(binary, rot).
+   """
+    flat = np.asarray(binaries, dtype="uint8").reshape(-1, 64)
+    packed = np.packbits(flat[:, ROTATION_INDEX], axis=-1)
+    return packed.view(">u8").reshape(np.shape(binaries)[:-2] + (4,))
+
+def packPattern(binary):
+    """Returns the 64-bit integer code of an 8x8 bit array."""
+    return int(rotationCodes(binary)[0])
+
+def orientCode(codes, turn=0):
+    """
+   Code equivalent of isAMarker.
+
+   Args:
+       codes: Rotation codes of a bit array as returned by rotationCodes.
+       turn (int): quarter rotations already applied to the bit array.
+
+   Returns:
+       Number of further rotations needed to orient the marker or None if it isn't a marker.
+   """
+    if codes[0] & BORDER_MASK:
+        return None
+    for rot in range(4):
+        if codes[(turn + rot) % 4] & ORIENTATION_MASK == ORIENTATION_BITS:
+            return rot
+    return None
+
+def compileCodebook(patterns):
+    """
+   Compiles marker patterns into code lookup tables.
+
+   Args:
+       patterns: Sequence of (8x8 NumPy pattern array, pattern ID string) tuples.
+
+   Returns:
+       patternCodes: Dictionary of pattern code to pattern ID string.
+       codebook: Dictionary of unrotated gray channel code to (pattern ID string, rotation)
+                 for every orientation in which a pattern is identified by its gray channel alone.
+   """
+    patternCodes = {}
+    for pattern, name in patterns:
+        patternCodes.setdefault(packPattern(pattern), name)
+
+    codebook = {}
+    for pattern, name in patterns:
+        codes = rotationCodes(pattern).tolist()
+        for rot in range(4):
+            raw = [codes[(turn - rot) % 4] for turn in range(4)]
+            if orientCode(raw) == rot:
+                codebook.setdefault(raw[0], (patternCodes[codes[0]], rot))
+
+    return patternCodes, codebook
+
+PATTERN_CODES, CODEBOOK = compileCodebook(PATTERNS)
+
 # Pattern Tester
 def checkPattern(mystery):
     """Checks an unknown array against known patterns, returns the matching pattern's identifier."""
-    for pattern in PATTERNS:
-        if np.allclose(mystery, pattern[0], 0, 0.5):
-            return pattern[1]
-    return False
+    return PATTERN_CODES.get(packPattern(mystery), False)
  
 # Color Finder
 def findColor(blueChannel, greenChannel, redChannel):
@@ -112,39 +189,51 @@ def findImgObject(imgObject):
         pass
     return imgObject
  
+def buildHsvLut():
+    """
+   Builds the lookup table used to quantize HSV images for marker detection.
+
+   Returns:
+       A (1, 256, 3) uint8 table mapping each hue, saturation and value
+       level to its aligned hue bucket, thresholded saturation and clamped value.
+   """
+    level = np.arange(256)
+
+    # Align Hue
+    hue = np.zeros(256, dtype="uint8") # red
+    hue[(level >= 15) & (level <= 45)] = 30 # yellow
+    hue[(level > 45) & (level <= 75)] = 60 # green
+    hue[(level > 75) & (level <= 105)] = 90 # cyan
+    hue[(level > 105) & (level <= 135)] = 120 # blue
+    hue[(level > 135) & (level <= 173)] = 150 # magenta
+
+    # Threshold Saturation
+    saturation = np.where(level > 64, 255, level).astype("uint8")
+
+    # Clamp Black
+    value = np.where(level < 85, 0, level).astype("uint8")
+
+    return np.dstack((hue, saturation, value))
+
+HSV_LUT = buildHsvLut()
+
 def hsvAdjustment(image):
     """Applys a threshold to saturation values and an alignment to hue values."""
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
- 
-    # Threshold Saturation
-    saturation = hsv[:, :, 1] # [0, 255]
-    np.place(hsv[:, :, 1], saturation > 64, 255)
- 
-    # Align Hue
-    hue = hsv[:, :, 0] # [0, 179]
-    np.place(hsv[:, :, 0], np.logical_or(hue < 15, hue > 173), 0) # red
-    np.place(hsv[:, :, 0], np.logical_and(hue >= 15, hue <= 45), 30) # yellow
-    np.place(hsv[:, :, 0], np.logical_and(hue > 45, hue <= 75), 60) # green
-    np.place(hsv[:, :, 0], np.logical_and(hue > 75, hue <= 105), 90) # cyan
-    np.place(hsv[:, :, 0], np.logical_and(hue > 105, hue <= 135), 120) # blue
-    np.place(hsv[:, :, 0], np.logical_and(hue > 135, hue <= 173), 150) # magenta
- 
-    # Clamp Black
-    value = hsv[:, :, 2]
-    np.place(hsv[:, :, 2], value < 85, 0)
- 
+    hsv = cv2.LUT(hsv, HSV_LUT)
     return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
  
 # Image Pre-Processing
-def imageProcessing(imgPath):
+def imageProcessing(imgPath, withHierarchy=False):
     """
    Processes an image for marker detection.
  
    Args:
        imgPath: Path to an openCV compatiable image.
+       withHierarchy (bool): also return the contour hierarchy.
  
    Returns:
-       Array of contours, openCV image object.
+       Array of contours, (contour hierarchy,) openCV image object.
    """
     # Pre-Processing
     img = findImgObject(imgPath)
@@ -159,92 +248,226 @@ def imageProcessing(imgPath):
     # Shape Detection
     contour = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
  
+    if withHierarchy:
+        return contour[0], contour[1], img
     return contour[0], img
  
 # Find Center of Quadrangles
 def findCenter(a, b, c, d):
-    """Returns the center of a quadrangle given 4 Shapley points in clockwise order."""
-    ac = LineString([a, c])
-    bd = LineString([b, d])
-    center = ac.intersection(bd)
-    try:
-        return (center.x, center.y)
-    except AttributeError:
+    """Returns the center of a quadrangle given 4 (x, y) points in clockwise order."""
+    center = qg.diagonalIntersection([a, b, c, d])[0]
+    if np.isnan(center[0]):
         return None
+    return (float(center[0]), float(center[1]))
+ 
+# Approximate Quadrangles
+def approximateQuad(shape, minPerimeter=0):
+    """Returns the 4 approximated corners of a quadrangle-like contour or None if not quadrangle-like."""
+    peri = cv2.arcLength(shape, True)
+    corners = cv2.approxPolyDP(shape, 0.02 * peri, True)
+    if len(corners) == 4 and peri > minPerimeter: # check shape is a quadrangle of useable size
+        return corners
+    return None
  
 # Check for Square
 def isSquare(shape, minPerimeter=0):
     """Returns the corners and center of a sqaure-like contour or false if not square-like."""
-    peri = cv2.arcLength(shape, True)
-    corners = cv2.approxPolyDP(shape, 0.02 * peri, True)
-    if len(corners) is 4 and peri > minPerimeter: # check shape is a quadrangle of useable size
-        a = Point(corners[0][0][0], corners[0][0][1])
-        b = Point(corners[1][0][0], corners[1][0][1])
-        c = Point(corners[2][0][0], corners[2][0][1])
-        d = Point(corners[3][0][0], corners[3][0][1])
-        ab = a.distance(b)
-        bc = b.distance(c)
-        lineRatio = max((ab, bc)) / min((ab, bc))
-        if lineRatio < 2: # check that quadrangle is likely a square
-            center = findCenter(a, b, c, d)
-            return corners, center
+    corners = approximateQuad(shape, minPerimeter)
+    if corners is not None and qg.isSquareLike(corners)[0]: # check that quadrangle is likely a square
+        a, b, c, d = corners.reshape(4, 2)
+        return corners, findCenter(a, b, c, d)
     return False, False
  
+# Contour Gating
+def contourDepths(hierarchy, count):
+    """Returns the nesting depth of each contour from an openCV RETR_TREE hierarchy."""
+    depth = np.zeros(count, dtype="int32")
+    if hierarchy is None or count == 0:
+        return depth
+    parent = hierarchy.reshape(-1, 4)[:, 3]
+    ancestor = parent.copy()
+    while np.any(ancestor >= 0):
+        nested = ancestor >= 0
+        depth[nested] += 1
+        ancestor = np.where(nested, parent[ancestor], -1)
+    return depth
+
+class ContourFilter(object):
+    """
+   Cheaply rejects contours that can't be markers ahead of polygon approximation.
+
+   Gates run from cheapest to most expensive. Counting is opt-in: a counting filter tallies the
+   contours each gate removed until reset, see report.
+
+   Args:
+       minArea: minimum contour area in px, None to disable.
+       maxAspect: maximum bounding box long side over short side, None to disable.
+       minSolidity: minimum contour area over convex hull area, None to disable.
+       depthRange: (min, max) nesting depth in the contour hierarchy, None to disable either bound.
+       counting (bool): tally the contours removed by each gate.
+   """
+    GATES = ('depth', 'area', 'aspect', 'convexity')
+
+    def __init__(self, minArea=64, maxAspect=5, minSolidity=0.8, depthRange=(None, None), counting=False):
+        self.minArea = minArea
+        self.maxAspect = maxAspect
+        self.minSolidity = minSolidity
+        self.depthRange = depthRange
+        self.counting = counting
+        self.reset()
+
+    def reset(self):
+        """Zeros the gate counters."""
+        self.counts = {'contours': 0, 'passed': 0}
+        for gate in self.GATES:
+            self.counts[gate] = 0
+
+    def rejection(self, shape):
+        """Returns the name of the first gate rejecting a single contour or None if it passes."""
+        if self.minArea is not None or self.minSolidity is not None:
+            area = cv2.contourArea(shape)
+        if self.minArea is not None and area < self.minArea:
+            return 'area'
+        if self.maxAspect is not None:
+            _, _, width, height = cv2.boundingRect(shape)
+            if max(width, height) > self.maxAspect * max(min(width, height), 1):
+                return 'aspect'
+        if self.minSolidity is not None:
+            hullArea = cv2.contourArea(cv2.convexHull(shape))
+            if hullArea == 0 or area < self.minSolidity * hullArea:
+                return 'convexity'
+        return None
+
+    def __call__(self, contour, hierarchy=None):
+        """Returns the indices of the contours passing every gate."""
+        count = len(contour)
+        counts = dict.fromkeys(self.counts, 0)
+        counts['contours'] = count
+        candidates = range(count)
+
+        # Hierarchy Depth
+        minDepth, maxDepth = self.depthRange
+        if hierarchy is not None and (minDepth is not None or maxDepth is not None):
+            depth = contourDepths(hierarchy, count)
+            keep = np.ones(count, dtype=bool)
+            if minDepth is not None:
+                keep &= depth >= minDepth
+            if maxDepth is not None:
+                keep &= depth <= maxDepth
+            candidates = np.flatnonzero(keep).tolist()
+            counts['depth'] = count - len(candidates)
+
+        # Shape Gates
+        passed = []
+        for index in candidates:
+            rejection = self.rejection(contour[index])
+            if rejection is None:
+                passed.append(index)
+            else:
+                counts[rejection] += 1
+        counts['passed'] = len(passed)
+
+        if self.counting:
+            for key, tally in counts.items():
+                self.counts[key] += tally
+
+        return passed
+
+    def report(self):
+        """Returns a printable summary of the gate counters."""
+        removed = ", ".join("{} {}".format(gate, self.counts[gate]) for gate in self.GATES)
+        return "Contours {} -> {} (removed {})".format(self.counts['contours'], self.counts['passed'], removed)
+
+# Shared by every findSquares Call, so it Doesn't Count
+CONTOUR_FILTER = ContourFilter()
+
 # Identify Squares from Shapes
-def findSquares(contour):
-    """Returns dictionary of square-like 'corners' and 'center(s)' from a set of contours."""
+def findSquares(contour, hierarchy=None, contourFilter=CONTOUR_FILTER):
+    """
+   Returns dictionary of square-like 'corners', 'center(s)' and 'contour' indices from a set of contours.
+
+   Args:
+       contour: Array of openCV contours.
+       hierarchy: Optional openCV contour hierarchy, used for depth gating.
+       contourFilter: ContourFilter applied ahead of polygon approximation, None to disable. The
+                      default CONTOUR_FILTER doesn't count, pass a counting filter to see its gates.
+   """
+    indices = range(len(contour))
+    if contourFilter is not None:
+        indices = contourFilter(contour, hierarchy)
+
+    quads = []
+    quadIndices = []
+    for index in indices:
+        corners = approximateQuad(contour[index])
+        if corners is not None:
+            quads.append(corners.reshape(4, 2))
+            quadIndices.append(index)
+    quads = np.array(quads, dtype="int32").reshape(-1, 4, 2)
+
+    # Test Every Quadrangle at Once
+    square = qg.isSquareLike(quads)
+    centers = qg.diagonalIntersection(quads)
+
     squares = []
-    c = -1
-    for shape in contour:
-        corners, center = isSquare(shape)
-        if corners is not False:
-            c += 1
-            squares.append([])
-            squares[c] = {}
-            squares[c]['corners'] = []
-            for pt in corners:
-                squares[c]['corners'].append([pt[0][0], pt[0][1]])
-            squares[c]['center'] = center
+    for corners, center, index in zip(quads[square], centers[square], np.array(quadIndices)[square]):
+        squares.append({})
+        squares[-1]['corners'] = [[x, y] for x, y in corners]
+        if np.isnan(center[0]):
+            squares[-1]['center'] = None
+        else:
+            squares[-1]['center'] = (float(center[0]), float(center[1]))
+        squares[-1]['contour'] = int(index)
     return squares
  
 # Sort for Interior Squares
-def removeExteriorSquares(squares):
-    """Sorts a sqaure-like dictionary returning a dictionary void of exterior bounding squares."""
-    removal = []
-    return squares
-    # Check for Squares contatined in other Squares
-    for sq, _ in enumerate(squares):
-        test = Polygon([(squares[sq]['corners'][0][0], squares[sq]['corners'][0][1]),
-                        (squares[sq]['corners'][1][0], squares[sq]['corners'][1][1]),
-                        (squares[sq]['corners'][2][0], squares[sq]['corners'][2][1]),
-                        (squares[sq]['corners'][3][0], squares[sq]['corners'][3][1])])
-        for bd, _ in enumerate(squares):
-            if bd == sq:
-                pass
-            else:
-                bding = Polygon([(squares[bd]['corners'][0][0], squares[bd]['corners'][0][1]),
-                                 (squares[bd]['corners'][1][0], squares[bd]['corners'][1][1]),
-                                 (squares[bd]['corners'][2][0], squares[bd]['corners'][2][1]),
-                                 (squares[bd]['corners'][3][0], squares[bd]['corners'][3][1])])
-                if test.contains(bding):
-                    removal.append(sq)
-                    break
- 
-    # Delete all Exterior Squares
-    removal.sort(reverse=True)
-    for index in removal:
-        del squares[index]
- 
-    return squares
+def removeNestedSquares(squares, hierarchy=None):
+    """
+   Sorts a sqaure-like dictionary returning a dictionary void of squares nested in other squares.
+
+   A marker's border yields both an outer square and nested squares along the inner edges of its
+   dark body; only the outer square frames the full 8x8 marker so the nested duplicates are removed.
+
+   Args:
+       squares: Sqaure-like dictionary from findSquares.
+       hierarchy: openCV RETR_TREE contour hierarchy the squares were found in. When supplied a
+                  square is nested if its immediate parent is the outer edge of a dark square,
+                  so markers inside light areas framed by dark squares are kept, otherwise
+                  squares with every corner inside another square are nested.
+
+   Returns:
+       Sqaure-like dictionary.
+   """
+    if len(squares) == 0:
+        return squares
+    if hierarchy is None:
+        # Check for Squares contatined in other Squares
+        quads = np.array([square['corners'] for square in squares]).reshape(-1, 4, 2)
+        nested = np.any(qg.quadsContain(quads), axis=0)
+    else:
+        # Outer Edges of Dark Regions are at Even Depths, the Edges of the Light Holes in them at Odd Depths
+        parent = hierarchy.reshape(-1, 4)[:, 3]
+        isSquare = np.zeros(len(parent), dtype=bool)
+        contours = np.array([square['contour'] for square in squares])
+        isSquare[contours] = True
+        outerEdge = contourDepths(hierarchy, len(parent)) % 2 == 0
+        enclosing = parent[contours]
+        nested = (enclosing >= 0) & isSquare[enclosing] & outerEdge[enclosing]
+
+    # Delete all Nested Squares
+    return [square for square, inside in zip(squares, nested) if not inside]
  
 # Create Marker Crops
-def markerDeformer(squares, img, size=256):
+def markerDeformer(squares, img, size=256, samples=None):
     """
    Deforms and crops an image into marker sqaures.
  
    Args:
        sqaures: Sqaure-like dictionary.
        img: openCV image object from which the square-like dictionary was derived.
+       size (int): width of the marker crops in px.
+       samples (int): when set, warp straight to a grid of 8x8 marker bits of samples x samples
+                      px each, sampling every bit at evenly spaced points about its center.
  
    Returns:
        A list of tuples in the form:
@@ -252,7 +475,12 @@ def markerDeformer(squares, img, size=256):
             center point coordinates in original image,
             list of corner coordinates from original image)
    """
-    square = np.array([[0, 0], [0, size], [size, size], [size, 0]], dtype="float32")
+    if samples:
+        size = 8 * samples
+        low, high = -0.5, size - 0.5 # align sample points to pixel centers
+    else:
+        low, high = 0, size
+    square = np.array([[low, low], [low, high], [high, high], [high, low]], dtype="float32")
     markers = []
     for rawMarker in squares:
         persp = cv2.getPerspectiveTransform(np.array(rawMarker['corners'], dtype="float32"), square)
@@ -262,12 +490,13 @@ def markerDeformer(squares, img, size=256):
     return markers # (marker image, center point of marker)
  
 ## MARKER DETECTION ##
-def findMarkers(imagePath):
+def findMarkers(imagePath, samples=None):
     """
    Finds markers in an image.
  
    Args:
        imagePath: Path to an openCV compatiable image.
+       samples (int): samples per marker bit side for direct to grid warping, None for 256px crops.
  
    Returns:
        A list of tuples in the form:
@@ -275,38 +504,154 @@ def findMarkers(imagePath):
             center point coordinates in original image,
             list of corner coordinates from original image)
    """
-    imageContours, image = imageProcessing(imagePath)
-    foundSquares = findSquares(imageContours)
-    sortedSquares = removeExteriorSquares(foundSquares)
-    foundMarkers = markerDeformer(sortedSquares, image)
+    imageContours, hierarchy, image = imageProcessing(imagePath, withHierarchy=True)
+    foundSquares = findSquares(imageContours, hierarchy)
+    sortedSquares = removeNestedSquares(foundSquares, hierarchy)
+    foundMarkers = markerDeformer(sortedSquares, image, samples=samples)
  
     return foundMarkers
  
+## YUV MARKER DETECTION ##
+ 
+def lumaProcessing(luma, withHierarchy=False):
+    """
+   Finds marker contours in the luma (Y) plane of an image.
+ 
+   Args:
+       luma: 2D uint8 NumPy array of the Y plane.
+       withHierarchy (bool): also return the contour hierarchy.
+ 
+   Returns:
+       Array of contours, (contour hierarchy).
+   """
+    _, mask = cv2.threshold(cv2.bitwise_not(luma), 255, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contour = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if withHierarchy:
+        return contour[0], contour[1]
+    return contour[0]
+
+def markerDeformerYuv(squares, luma, u, v, samples=GRID_SAMPLES):
+    """
+   Deforms the planes of a YUV 4:2:0 image straight to the bit grids of marker squares.
+ 
+   Luma is sampled at full resolution and the quarter resolution chroma planes are sampled
+   only at the same grid points, then the grids are converted to color.
+ 
+   Args:
+       sqaures: Sqaure-like dictionary.
+       luma: Full resolution Y plane the square-like dictionary was derived from.
+       u, v: Half width, half height U and V planes.
+       samples (int): samples per marker bit side.
+ 
+   Returns:
+       A list of tuples in the form:
+           (hsv adjusted openCV BGR image of the marker bit grid,
+            center point coordinates in original image,
+            list of corner coordinates from original image)
+   """
+    size = 8 * samples
+    square = np.array([[-0.5, -0.5], [-0.5, size - 0.5], [size - 0.5, size - 0.5], [size - 0.5, -0.5]],
+                      dtype="float32")
+    lumaToChroma = np.array([[0.5, 0, -0.25], [0, 0.5, -0.25], [0, 0, 1]])
+    chromaToLuma = np.linalg.inv(lumaToChroma)
+
+    markers = []
+    for rawMarker in squares:
+        persp = cv2.getPerspectiveTransform(np.array(rawMarker['corners'], dtype="float32"), square)
+        chromaPersp = persp.dot(chromaToLuma)
+        yuv = np.dstack((cv2.warpPerspective(luma, persp, (size, size)),
+                         cv2.warpPerspective(u, chromaPersp, (size, size)),
+                         cv2.warpPerspective(v, chromaPersp, (size, size))))
+        markers.append((hsvAdjustment(yc.yuv2bgr(yuv)), rawMarker['center'], rawMarker['corners']))
+
+    return markers
+
+def findMarkersYuv(luma, u, v, samples=GRID_SAMPLES):
+    """
+   Finds markers in the planes of a YUV 4:2:0 image without converting the whole frame to BGR.
+ 
+   Args:
+       luma: Full resolution Y plane.
+       u, v: Half width, half height U and V planes.
+       samples (int): samples per marker bit side.
+ 
+   Returns:
+       A list of marker tuples, as findMarkers.
+   """
+    imageContours, hierarchy = lumaProcessing(luma, withHierarchy=True)
+    foundSquares = findSquares(imageContours, hierarchy)
+    sortedSquares = removeNestedSquares(foundSquares, hierarchy)
+    return markerDeformerYuv(sortedSquares, luma, u, v, samples)
+ 
 ## MARKER IDENTIFICATION ##
  
 # Create Marker Binary Maps
-def createMarkerBinaryMaps(warpedMarker, bitSize=32):
-    """Returns thresholded 8x8 numPy bit per channel arrays from marker images."""
-    tag = np.empty([8, 8, 4])
-    yChunk = 0
-    while yChunk < 8:
-        xChunk = 0
-        while xChunk < 8: # Average each channel of each bit
-            tag[yChunk, xChunk] = cv2.mean(warpedMarker[(yChunk*bitSize) : ((yChunk+1)*bitSize),
-                                                        (xChunk*bitSize) : ((xChunk+1)*bitSize)])
-            xChunk += 1
-        yChunk += 1
- 
+def otsuBinary(values):
+    """
+   Applies an Otsu binary threshold to each row of a stack of uint8 values.
+
+   Args:
+       values: (N, M) uint8 NumPy array, one row of M values per image.
+
+   Returns:
+       (N, M) uint8 NumPy array of 0 or 1 bits, matching cv2.threshold with
+       THRESH_BINARY + THRESH_OTSU and a max value of 1 on each row.
+   """
+    rows, count = values.shape
+    offset = np.arange(rows)[:, None] * 256
+    histogram = np.bincount((values + offset).ravel(), minlength=rows * 256).reshape(rows, 256)
+
+    # Class Weights and Moments for Every Candidate Threshold
+    n1 = np.cumsum(histogram, axis=1)
+    s1 = np.cumsum(histogram * np.arange(256), axis=1)
+    total = s1[:, -1:]
+
+    # Between Class Variance (scaled), Undefined Where a Class is Empty
+    valid = (n1 > 0) & (n1 < count)
+    numerator = (count * s1 - n1 * total).astype("float64") ** 2
+    denominator = np.where(valid, n1 * (count - n1), 1)
+    sigma = np.where(valid, numerator / denominator, 0)
+
+    threshold = np.argmax(sigma, axis=1)
+    return (values > threshold[:, None]).astype("uint8")
+
+def createMarkerBinaryMapsBatch(warpedMarkers, bitSize=32):
+    """
+   Returns thresholded 8x8 bit per channel arrays for a stack of marker images.
+
+   Args:
+       warpedMarkers: (N, 8*bitSize, 8*bitSize, 3) uint8 NumPy array of marker crops.
+       bitSize (int): width of each marker bit in pixels.
+
+   Returns:
+       gray, blue, green, red (N, 8, 8) uint8 NumPy bit arrays.
+   """
+    count = len(warpedMarkers)
+    if count == 0:
+        empty = np.empty((0, 8, 8), dtype="uint8")
+        return empty, empty, empty, empty
+
+    # Average each channel of each bit, summing rows then columns of every cell
+    rows = warpedMarkers.reshape(count * 8, bitSize, -1).sum(axis=1, dtype="uint32")
+    sums = rows.reshape(count * 64, bitSize, 3).sum(axis=1, dtype="uint32")
+    cleanTags = (sums // (bitSize * bitSize)).astype("uint8").reshape(count, 8, 8, 3)
+
     # Threshold Bits per Channel BGR
-    cleanTag = np.delete(tag, 3, 2)
-    cleanTag = np.array(cleanTag, dtype="uint8")
-    grayTag = cv2.cvtColor(cleanTag, cv2.COLOR_BGR2GRAY)
-    _, grayBinary = cv2.threshold(grayTag, 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    _, blueBinary = cv2.threshold(cleanTag[:, :, 0], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    _, greenBinary = cv2.threshold(cleanTag[:, :, 1], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    _, redBinary = cv2.threshold(cleanTag[:, :, 2], 128, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
- 
-    return grayBinary, blueBinary, greenBinary, redBinary
+    grayTags = cv2.cvtColor(cleanTags.reshape(count * 8, 8, 3), cv2.COLOR_BGR2GRAY)
+    channels = np.concatenate((grayTags.reshape(count, 64),
+                               cleanTags[:, :, :, 0].reshape(count, 64),
+                               cleanTags[:, :, :, 1].reshape(count, 64),
+                               cleanTags[:, :, :, 2].reshape(count, 64)))
+    binary = otsuBinary(channels).reshape(4, count, 8, 8)
+
+    return binary[0], binary[1], binary[2], binary[3]
+
+def createMarkerBinaryMaps(warpedMarker, bitSize=None):
+    """Returns thresholded 8x8 numPy bit per channel arrays from marker images."""
+    if bitSize is None:
+        bitSize = warpedMarker.shape[0] // 8
+    gray, blue, green, red = createMarkerBinaryMapsBatch(warpedMarker[None], bitSize)
+    return gray[0], blue[0], green[0], red[0]
  
 def isBoxed(binary):
     """Determines if a bit array contains the marker border box."""
@@ -378,7 +723,15 @@ def findPattern(grayChannel, redChannel, greenChannel, blueChannel, rot):
                 pattern = checkPattern(blueChannel)
     return pattern
  
-def identifyMarker(unkownMarker):
+def findPatternCode(grayCode, redCode, greenCode, blueCode):
+    """Code equivalent of findPattern given the codes of the already rotated channels."""
+    for code in (grayCode, redCode, greenCode, blueCode):
+        pattern = PATTERN_CODES.get(code, False)
+        if pattern is not False:
+            return pattern
+    return False
+
+def identifyMarker(unkownMarker, binaryMaps=None, codes=None):
     """
    Identifies the color, pattern, center and corners of a marker.
  
@@ -386,42 +739,79 @@ def identifyMarker(unkownMarker):
        unknownMarker: A tuple in the form: (openCV image object of marker crop,
                                             center point coordinates in original image,
                                             list of corner coordinates from original image)
+       binaryMaps: Optional precomputed (gray, blue, green, red) bit arrays of the marker crop.
+       codes: Optional precomputed rotation codes of the binary maps from rotationCodes.
  
    Returns:
        Color ID String, Pattern ID String, Marker Center Coordinates (x, y), Marker Corner Array.
    """
-    gray, blue, green, red = createMarkerBinaryMaps(unkownMarker[0])
-    isMarker, rotation, gray = isAMarker(gray)
- 
-    if isMarker is False:
-        isMarker, rotation, red = isAMarker(red)
-        if isMarker is False:
+    if binaryMaps is None:
+        binaryMaps = createMarkerBinaryMaps(unkownMarker[0])
+    gray, blue, green, red = binaryMaps
+    if codes is None:
+        codes = rotationCodes(np.stack(binaryMaps)).tolist()
+    grayCodes, blueCodes, greenCodes, redCodes = codes
+
+    # Codebook Lookup
+    entry = CODEBOOK.get(grayCodes[0])
+    if entry is not None:
+        color = findColor(blue, green, red)
+        return color, entry[0], unkownMarker[1], unkownMarker[2]
+
+    # Marker Orientation, tracking the rotations applied to the gray & red channels
+    grayTurn, redTurn = 0, 0
+    rotation = orientCode(grayCodes)
+    if rotation is not None:
+        grayTurn = rotation
+    else:
+        rotation = orientCode(redCodes)
+        if rotation is None:
             return None
- 
+        redTurn = rotation
+
     # Pattern Identification
-    pattern = findPattern(gray, red, green, blue, rotation)
+    pattern = findPatternCode(grayCodes[grayTurn % 4], redCodes[(redTurn + rotation) % 4],
+                              greenCodes[rotation % 4], blueCodes[rotation % 4])
     if pattern is False: # Rotate gray once and force pattern search again
-        gray = np.rot90(gray)
-        isMarker, newRotation, gray = isAMarker(gray)
-        rotation = newRotation + rotation + 1
-        if isMarker is False:
-            isMarker, rotation, red = isAMarker(red)
-            if isMarker is False:
+        grayTurn += 1
+        newRotation = orientCode(grayCodes, grayTurn)
+        if newRotation is not None:
+            grayTurn += newRotation
+            rotation = newRotation + rotation + 1
+        else:
+            rotation = orientCode(redCodes, redTurn)
+            if rotation is None:
                 return None
-        pattern = findPattern(gray, red, green, blue, rotation)
- 
+            redTurn += rotation
+        pattern = findPatternCode(grayCodes[grayTurn % 4], redCodes[(redTurn + rotation) % 4],
+                                  greenCodes[rotation % 4], blueCodes[rotation % 4])
+
     # Determine Color
-    color = findColor(blue, green, red)
- 
+    color = findColor(blue, green, np.rot90(red, redTurn))
+
     return color, pattern, unkownMarker[1], unkownMarker[2] # (color, pattern, center, [corners])
  
-def markerID(imagePath):
-    """"Returns an Identified Markers Dictionary from an openCV compatible image path."""
+def identifyMarkers(markers):
+    """Returns an Identified Markers Dictionary from a list of marker tuples."""
     markerIDs = []
-    markers = findMarkers(imagePath)
-    for marker in markers:
-        markerIDs.append(identifyMarker(marker))
+    if len(markers) == 0:
+        return organizeMarkerIDs(markerIDs)
+
+    # Sample the Bits of Every Candidate at Once
+    crops = np.stack([marker[0] for marker in markers])
+    gray, blue, green, red = createMarkerBinaryMapsBatch(crops, crops.shape[1] // 8)
+    codes = rotationCodes(np.stack((gray, blue, green, red), axis=1)).tolist()
+    for i, marker in enumerate(markers):
+        markerIDs.append(identifyMarker(marker, (gray[i], blue[i], green[i], red[i]), codes[i]))
     return organizeMarkerIDs(markerIDs)
+
+def markerID(imagePath, samples=GRID_SAMPLES):
+    """"Returns an Identified Markers Dictionary from an openCV compatible image path."""
+    return identifyMarkers(findMarkers(imagePath, samples))
+
+def markerIDYuv(luma, u, v, samples=GRID_SAMPLES):
+    """Returns an Identified Markers Dictionary from the Y, U and V planes of a YUV 4:2:0 image."""
+    return identifyMarkers(findMarkersYuv(luma, u, v, samples))
  
 def createEmptyMarkerDictionary(empty=None):
     """Returns an empty marker dictionary of patterns sorted inside colors."""
@@ -5,25 +5,15 @@ import time
 import math
 import pickle
 import threading
+import multiprocessing
 import concurrent.futures
-import cameraTrigger
+import numpy as np
 import cameraCalibration as cc
 import mocapSolver as solver
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
-from firebase_admin import storage
+import detectionFormat as df
 
-STORAGE = r"F:\mocapMath\Sandbox\rpi"
-HOSTS = ["blueTriangle", "greenTriangle"]
-
-# Use a service account
-cred = credentials.Certificate('secret/raspberryPi.json')
-firebase_admin.initialize_app(cred, {'storageBucket': 'mocapboston.appspot.com'})
-
-firestoreDatabase = firestore.client()
-COLLECTION = firestoreDatabase.collection(u'dev')
-BUCKET = storage.bucket()
+# Worker Processes Solving the Frames of a Take, One per Core
+SOLVE_PROCESSES = os.cpu_count()
 
 class buttonInput:
     def __init__(self, GUI):
@@ -99,6 +89,7 @@ class camera:
     def __init__(self, cameraName):
         self.cameraPath = os.path.join(STORAGE, cameraName)
         self.cameraName = cameraName
+        self.model = None
 
         if os.path.isfile(os.path.join(self.cameraPath, "lens.npz")):
             self.matrix, self.distortion, self.fov = cc.importCalibration(os.path.join(self.cameraPath, "lens.npz"))
@@ -136,6 +127,7 @@ class camera:
         self.matrix = matrix
         self.distortion = distortion
         self.fov = fov
+        self.model = None
 
         cc.exportCalibration(os.path.join(self.cameraPath, "lens"), matrix, distortion, fov)
         self.lens = True
@@ -146,6 +138,7 @@ class camera:
         
         self.position = position
         self.rotation = (rotation[0] + math.pi, rotation[1], rotation[2])
+        self.model = None
 
         with open(os.path.join(self.cameraPath, "world.camera"), "wb") as data:
             payload = (self.position, self.rotation)
@@ -159,9 +152,17 @@ class camera:
     def getProperties(self):
         return (self.position[0], self.position[1], self.position[2], self.rotation[0], self.rotation[1], self.rotation[2], self.fov[0], self.fov[1])
 
+    def getModel(self):
+        # Ray Model Built once per Calibration, the Lens File Stores its Field of View in Degrees
+        if self.model is None:
+            self.model = solver.CameraModel(self.position, self.rotation, np.radians(self.fov),
+                                            lens=(self.matrix, self.distortion))
+        return self.model
+
 class serverGUI:
-    def __init__(self, master):
+    def __init__(self, master, solvePool):
         self.master = master
+        self.solvePool = solvePool
         master.title("mocapBoston")
         master.minsize(width=640, height=480)
         master.maxsize(width=640, height=480)
@@ -176,7 +177,7 @@ class serverGUI:
         self.awbMode = cameraSetting("AWB Mode", ["auto", "tungsten", "fluorescent", "sun"], ["auto", "tungsten", "f-scent", "sun"])
         self.maxTime = cameraSetting("Record Duration", [30, 15, 10, 5, 1], ["30", "15", "10", "5", "1"])
         self.pattern = cameraSetting("Calibration Pattern", ["6-4-", "9-7-"], ["6x4", "9x7"])
-        self.cameraSelect = cameraSetting("Camera Selection", [0, 1, 2, 3], ["blueTri", "greenTri", "redY", "cyanY"])
+        self.cameraSelect = cameraSetting("Camera Selection", list(range(len(HOSTS))), HOSTS)
 
         # Setup Inputs, Configured to Allow non-RPi Debugging via Keyboard
         self.interface = buttonInput(self)
@@ -306,30 +307,16 @@ class serverGUI:
 
         markers = []
         cameras = []
-        length = 10000
         for mocap in os.listdir(self.captureDirectory):
             cameraID = mocap.split("_")[0]
             cameraIndex = HOSTS.index(cameraID)
             cam = self.cameras[cameraIndex]
-            cameras.append(cam)
+            cameras.append(cam.getModel())
 
             mocapFile = os.path.join(self.captureDirectory, mocap)
-            with open(mocapFile, "rb") as binary:
-                marker = pickle.load(binary)
-            
-            markers.append(marker)
-            if len(marker) < length:
-                length = len(marker)
-            
-        frame = 0
-        self.solved = []
-        while frame < length:
-            persp = []
-            for i, angle in enumerate(markers):
-                camProps = cameras[i].getProperties()
-                persp.append((angle[frame], camProps))        
-            self.solved.append(solver.solveFrame(*persp))
-            frame += 1
+            markers.append(df.loadDetectionArrays(mocapFile))
+
+        self.solved = solver.solveParallel(markers, cameras, self.solvePool, SOLVE_PROCESSES)
         
         # Post Processing
         with open(os.path.join(self.captureDirectory, "solve.mocap"), "wb") as data:
@@ -443,8 +430,7 @@ class serverGUI:
             cam = self.cameras[cameraIndex]
 
             mocapFile = os.path.join(self.worldMarkersDir, mocap)
-            with open(mocapFile, "rb") as binary:
-                markers = pickle.load(binary)
+            markers = df.loadDetections(mocapFile)
             
             imagePoints, objectPoints = cc.correlatePlacementWithDetection(self.worldPattern, markers[25])
             position, rotation = cc.solveCamera(cam.matrix, cam.distortion, imagePoints, objectPoints)
@@ -523,6 +509,8 @@ class serverGUI:
             self.destroyFPStime()
             self.drawAWBshutdown()
         elif self.screen == "AWBshutdown":
+            cameraTrigger.POOL.close()
+            self.solvePool.terminate()
             sys.exit()
         elif self.screen == "Recording":
             self.destroyRecording()
@@ -613,11 +601,33 @@ class statusTimer:
     def reset(self):
         self.elapsed = -1
 
-root = tk.Tk()
-gui = serverGUI(root)
-try:
-    root.attributes('-fullscreen', True)
-except tk.TclError:
-    print("Couldn't Enter Fullscreen")
+if __name__ == "__main__":
+    # Start the Solve Workers before Tk and the Capture Threads, Spawned Workers Import this Module
+    # so the Cameras and Firebase are only Set Up Below
+    solvePool = multiprocessing.Pool(SOLVE_PROCESSES)
+
+    import cameraTrigger
+    import firebase_admin
+    from firebase_admin import credentials
+    from firebase_admin import firestore
+    from firebase_admin import storage
+
+    STORAGE = cameraTrigger.STORAGE
+    HOSTS = cameraTrigger.HOST
+
+    # Use a service account
+    cred = credentials.Certificate('secret/raspberryPi.json')
+    firebase_admin.initialize_app(cred, {'storageBucket': 'mocapboston.appspot.com'})
+
+    firestoreDatabase = firestore.client()
+    COLLECTION = firestoreDatabase.collection(u'dev')
+    BUCKET = storage.bucket()
+
+    root = tk.Tk()
+    gui = serverGUI(root, solvePool)
+    try:
+        root.attributes('-fullscreen', True)
+    except tk.TclError:
+        print("Couldn't Enter Fullscreen")
 
-root.mainloop()
+    root.mainloop()
@@ -1,95 +1,113 @@
-import math
 import os
-import sys
 import numpy as np
-import mathutils
+import cv2
+import transforms3d.euler as euler
 from itertools import combinations
+from multiprocessing import shared_memory, resource_tracker
 
 RESOLUTION = (1632, 1232)
 
+# Fewest Frames Worth Handing to a Solve Worker, Shorter Takes are Solved in Process
+# Sharing a Take Costs ~5 ms and each Range ~0.5-3 ms, a 3 Camera Frame Solves in ~0.13 ms
+# so 240 Frames (~30 ms) Keep the Hand Off Near a Tenth of the Work, see benchmark.py parallel
+PARALLEL_FRAMES = 240
+
 # Detections String ID Constants
 COLOR_ID = ['red', 'yellow', 'green', 'cyan', 'blue', 'magenta', False]
 PATTERN_ID = ['triangle', 'square', 'circle', 'slash', 'line', 'y', False]
 
+# Start the Shared Memory Tracker before any Solve Pool is Forked, see frameStore
+if os.name == 'posix':
+    resource_tracker.ensure_running()
+
 def angleOfViewCalc(cam, aov, trackPos):
 
     '''Calculates the angle of view distortion on the projected
     track and adds that to the camera rotation.  Returns tuple.'''
 
-    trackAOV = []
+    # rotate camera about its own axes based on tracker-based compensations
+    rotation = euler.euler2mat(float(cam[0]), float(cam[1]), float(cam[2])) @ trackRotation(aov, trackPos)
 
-    # calculate the camera angle compensation based on track pixel positon
-    trackAOV.append((float(trackPos[0]) - 0.5) * float(aov[0])) # x adjusts y
-    trackAOV.append((float(trackPos[1]) - 0.5) * float(aov[1])) # z adjusts x
+    return euler.mat2euler(rotation)
 
-    # import camera rotational euler angles
-    cameraEuler = mathutils.Euler((float(cam[0]), float(cam[1]), float(cam[2])))
-    # rotate camera based on tracker-based compensations
-    cameraEuler.rotate_axis('X', trackAOV[1])
-    cameraEuler.rotate_axis('Y', -1 * trackAOV[0])
+def trackRotation(aov, trackPos):
 
-    return (cameraEuler.x, cameraEuler.y, cameraEuler.z)
+    '''Returns the rotation matrix of the angle of view compensation of
+    a track, applied in the camera's local space.'''
 
-def pointRotate(p1, p2, p0, theta):
-
-    '''
-    Returns a point rotated about an arbitrary axis in 3D.
-    Positive angles are counter-clockwise looking down the axis toward the origin.
-    The coordinate system is assumed to be right-hand.
-    Arguments: 'axis p1', 'axis p2', 'p to be rotated', 'rotation (in radians)'
-    Reference 'Rotate A Point About An Arbitrary Axis (3D)' - Paul Bourke
-    '''
+    # calculate the camera angle compensation based on track pixel positon
+    trackX = (np.asarray(trackPos[0], dtype='float64') - 0.5) * float(aov[0]) # x adjusts y
+    trackY = (np.asarray(trackPos[1], dtype='float64') - 0.5) * float(aov[1]) # z adjusts x
+
+    # local X rotation by trackY followed by local Y rotation by -trackX
+    cosX, sinX = np.cos(trackX), np.sin(trackX)
+    cosY, sinY = np.cos(trackY), np.sin(trackY)
+    zero = np.zeros_like(trackX)
+    return np.stack((np.stack((cosX, zero, -sinX), axis=-1),
+                     np.stack((-sinY * sinX, cosY, -sinY * cosX), axis=-1),
+                     np.stack((cosY * sinX, sinY, cosY * cosX), axis=-1)), axis=-2)
+
+class CameraModel(object):
+    """
+    Ray model of a camera with its orientation computed once.
 
-    # Modified from code written by Bruce Vaughan of BV Detailing & Design
-    # http://paulbourke.net/geometry/rotate/PointRotate.py
-
-    # Translate so axis is at origin
-    p = []
-    for point in range(0, 3):
-        p.append(p0[point] - p1[point])
-
-    # Initialize point q
-    q = [0.0, 0.0, 0.0]
-    N = []
-    for point1 in range(0, 3):
-        N.append(p2[point1] - p1[point1])
-
-    Nm = math.sqrt(N[0]**2 + N[1]**2 + N[2]**2)
-
-    # Rotation axis unit vector
-    n = (N[0]/Nm, N[1]/Nm, N[2]/Nm)
-
-    # Matrix common factors
-    c = math.cos(theta)
-    t = (1 - math.cos(theta))
-    s = math.sin(theta)
-    X = n[0]
-    Y = n[1]
-    Z = n[2]
-
-    # Matrix 'M'
-    d11 = t*X**2 + c
-    d12 = t*X*Y - s*Z
-    d13 = t*X*Z + s*Y
-    d21 = t*X*Y + s*Z
-    d22 = t*Y**2 + c
-    d23 = t*Y*Z - s*X
-    d31 = t*X*Z - s*Y
-    d32 = t*Y*Z + s*X
-    d33 = t*Z**2 + c
-
-    #            |p.x|
-    # Matrix 'M'*|p.y|
-    #            |p.z|
-    q[0] = d11*p[0] + d12*p[1] + d13*p[2]
-    q[1] = d21*p[0] + d22*p[1] + d23*p[2]
-    q[2] = d31*p[0] + d32*p[1] + d33*p[2]
-
-    # Translate axis and rotated point back to original location
-    answer = []
-    for point2 in range(0, 3):
-        answer.append(q[point2] + p1[point2])
-    return answer
+    Args:
+        position: (x, y, z) camera position
+        rotation: (x, y, z) camera rotation as XYZ euler angles in radians
+        aov: (horizontal, vertical) angle of view in radians
+        resolution: (width, height) of the frames detections are measured in
+        lens: (camera matrix, distortion coefficients) of the calibrated lens, see cameraCalibration,
+              rays are cast through the angle of view without distortion if None
+    """
+    def __init__(self, position, rotation, aov, resolution=RESOLUTION, lens=None):
+        self.origin = np.asarray(position, dtype='float64').reshape(3)
+        self.rotation = euler.euler2mat(*(float(angle) for angle in rotation))
+        self.aov = (float(aov[0]), float(aov[1]))
+        self.resolution = np.array(resolution, dtype='float64')
+        self.lens = None if lens is None else tuple(np.asarray(array, dtype='float64') for array in lens)
+
+    @classmethod
+    def fromTuple(cls, camera):
+        """Returns the model of a camera tuple in the form (posX, posY, posZ, rotX, rotY, rotZ, aovX, aovY)."""
+        if isinstance(camera, cls):
+            return camera
+        return cls(camera[:3], camera[3:6], camera[6:8])
+
+    def trackRays(self, markerPositions):
+        """
+        Returns the unit directions of the rays through marker positions.
+
+        Args:
+            markerPositions: (..., 2) numpy array of (x, y) percentages across the frame
+
+        Returns:
+            (..., 3) numpy array of world space ray directions
+        """
+        markerPositions = np.asarray(markerPositions, dtype='float64')
+        # (0, 0, -1) turned by the track compensation
+        local = -trackRotation(self.aov, (markerPositions[..., 0], markerPositions[..., 1]))[..., :, 2]
+        return local @ self.rotation.T
+
+    def lensRays(self, pixels):
+        """
+        Returns the (..., 3) unit ray directions through (..., 2) pixel positions in the camera's space,
+        undistorted through the lens calibration in one batch.
+
+        World calibrations turn openCV's camera space (y down, z forward) half a turn about X into the
+        solver's (y up, looking down -z), see solveCamera and the GUI's writeNewWorldFile.
+        """
+        pixels = np.asarray(pixels, dtype='float64')
+        coordinates = np.empty(pixels.shape)
+        if pixels.size:
+            coordinates[...] = cv2.undistortPoints(pixels.reshape(-1, 1, 2), *self.lens).reshape(pixels.shape)
+        local = np.stack((coordinates[..., 0], -coordinates[..., 1], -np.ones(pixels.shape[:-1])), axis=-1)
+        return local / np.linalg.norm(local, axis=-1, keepdims=True)
+
+    def rays(self, pixels):
+        """Returns the (..., 3) unit directions of the rays through (..., 2) pixel positions."""
+        if self.lens is not None:
+            return self.lensRays(pixels) @ self.rotation.T
+        return self.trackRays(np.asarray(pixels, dtype='float64') / self.resolution)
 
 def pointsOnLine(camera, markerPosition):
     '''
@@ -102,27 +120,11 @@ def pointsOnLine(camera, markerPosition):
     
     '''
 
-    # extract camera variables
-    originPoint = (camera[0], camera[1], camera[2])
-    cameraRotation = (camera[3], camera[4], camera[5])
-    cameraAOV = (camera[6], camera[7])
+    # cast the ray through the marker from the camera's model
+    model = CameraModel.fromTuple(camera)
+    direction = model.trackRays(markerPosition)
 
-    # account for marker based angle modifers
-    rotation = angleOfViewCalc(cameraRotation, cameraAOV, markerPosition)
-
-    # rotate point projected from original camera position about origin
-    cameraPoint = (0, 0, -1)
-    xRotate = pointRotate((0, 0, 0), (5, 0, 0), cameraPoint, rotation[0])
-    yRotate = pointRotate((0, 0, 0), (0, 5, 0), xRotate, rotation[1])
-    zRotate = pointRotate((0, 0, 0), (0, 0, 5), yRotate, rotation[2])
-
-    # translate offset point to align with camera position
-    newPoint = []
-    for r in range(0, 3):
-        newPoint.append(zRotate[r] + float(originPoint[r]))
-    
-    o = np.array([originPoint[0], originPoint[1], originPoint[2]])
-    return (np.reshape(o, (3)), np.array([newPoint[0], newPoint[1], newPoint[2]]))
+    return (model.origin.copy(), model.origin + direction)
 
 def closestDistanceBetweenLines(a0, a1, b0, b1):
 
@@ -268,4 +270,216 @@ def solveFrame(*persp):
                 else:
                     solved.append(("{} {}".format(color, pattern), (points[0][0], points[0][1], points[0][2]), points[0][3]))
     
-    return solved
\ No newline at end of file
+    return solved
+
+def sessionRays(points, valid, cameras):
+    """
+    Casts the rays of every detection of a session.
+
+    Args:
+        points: (frames, markers, cameras, 2) array of marker center pixel positions
+        valid: (frames, markers, cameras) boolean array, True where the camera detected the marker
+        cameras: list of CameraModels or camera tuples in the form (posX, posY, posZ, rotX, rotY, rotZ, aovX, aovY)
+
+    Returns:
+        valid array excluding centers that weren't found, (cameras, 3) array of camera origins &
+        (frames, markers, cameras, 3) array of ray directions
+    """
+
+    # Check for Enough Camera Angles
+    if len(cameras) < 2:
+        raise Exception
+
+    valid = valid & ~np.isnan(points).any(axis=-1)
+    models = [CameraModel.fromTuple(camera) for camera in cameras]
+    origins = np.array([model.origin for model in models])
+    directions = np.empty(np.shape(points)[:3] + (3,))
+    for c, model in enumerate(models):
+        directions[:, :, c] = model.rays(points[:, :, c])
+    return valid, origins, directions
+
+def solvePairs(points, valid, cameras):
+    """
+    Solve all markers of every frame of a session at once by averaging camera pairs, matching
+    solveFrame for every frame.
+
+    Args:
+        see sessionRays
+
+    Returns:
+        (frames, markers, 3) array of triangulated points averaged over the camera pairs,
+        (frames, markers) array of the average distance between the pairs' lines &
+        (frames, markers) boolean array, True where a marker was solved
+    """
+    valid, origins, directions = sessionRays(points, valid, cameras)
+
+    # Closest Points Between the Lines of Every Camera Pair, see closestDistanceBetweenLines
+    pairA, pairB = np.array(list(combinations(range(len(cameras)), 2))).T
+    A = directions[:, :, pairA]
+    B = directions[:, :, pairB]
+    t = origins[pairB] - origins[pairA]
+    cross = np.cross(A, B)
+    denom = np.sum(cross**2, axis=-1)
+    pair = valid[:, :, pairA] & valid[:, :, pairB] & (denom > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t0 = np.sum(t * np.cross(B, cross), axis=-1) / denom
+        t1 = np.sum(t * np.cross(A, cross), axis=-1) / denom
+    pA = origins[pairA] + A * t0[..., None]
+    pB = origins[pairB] + B * t1[..., None]
+
+    # Average the Triangulated Points of the Pairs that Detected each Marker
+    count = np.sum(pair, axis=-1)
+    solved = count > 0
+    divisor = np.maximum(count, 1)
+    midpoints = np.where(pair[..., None], (pA + pB) / 2, 0)
+    distances = np.where(pair, np.linalg.norm(pA - pB, axis=-1), 0)
+    return np.sum(midpoints, axis=2) / divisor[..., None], np.sum(distances, axis=2) / divisor, solved
+
+def solveSession(points, valid, cameras):
+    """
+    Solve all markers of every frame of a session at once, each point in one least squares solve
+    over the rays of every camera that detected it.
+
+    The point closest to all of a marker's rays minimizes the summed squared distances to the
+    rays, sum((I - d d^T) (X - o)), so it solves the 3x3 system sum(I - d d^T) X = sum((I - d d^T) o).
+    The cost grows linearly with the cameras instead of with their pairs, and a bad view weighs in
+    once rather than in every pair it's part of.
+
+    Args:
+        see sessionRays
+
+    Returns:
+        (frames, markers, 3) array of triangulated points,
+        (frames, markers) array of residuals, the root mean square distance from each point to its rays &
+        (frames, markers) boolean array, True where a marker was solved
+    """
+    valid, origins, directions = sessionRays(points, valid, cameras)
+
+    # Zero the Rays of Missing Detections, Masking by Multiplication Keeps the NaN Rays of Missing Centers
+    directions = np.where(valid[..., None], directions, 0)
+
+    # Sum the Projections Perpendicular to the Rays of every Detection, without Forming them
+    count = np.sum(valid, axis=-1)
+    normal = count[..., None, None] * np.eye(3) - np.swapaxes(directions, 2, 3) @ directions
+    along = np.sum(directions * origins, axis=-1)
+    target = valid @ origins - np.sum(directions * along[..., None], axis=2)
+
+    # Markers Need 2 Rays that aren't Parallel
+    solved = (count > 1) & (np.abs(np.linalg.det(normal)) > 1e-12)
+    normal[~solved] = np.eye(3)
+    solvedPoints = np.linalg.solve(normal, target[..., None])[..., 0]
+
+    # Residual Distances from each Point to its Rays
+    offsets = solvedPoints[:, :, None] - origins
+    perpendicular = np.sum(offsets**2, axis=-1) - np.sum(directions * offsets, axis=-1)**2
+    residuals = np.sqrt(np.maximum(np.sum(perpendicular * valid, axis=-1), 0) / np.maximum(count, 1))
+    return solvedPoints, residuals, solved
+
+def solvedFrames(points, distances, solved):
+    """
+    Lists the solved markers of each frame of solveSession's arrays.
+
+    Returns:
+        List of frames, each a list in the form of ("{color} {pattern}", (x, y, z), distance or residual)
+    """
+    labels = ["{} {}".format(color, pattern) for color in COLOR_ID for pattern in PATTERN_ID]
+    frames = []
+    for framePoints, frameDistances, frameSolved in zip(points.tolist(), distances.tolist(), solved.tolist()):
+        frames.append([(labels[m], tuple(framePoints[m]), frameDistances[m]) for m, found in enumerate(frameSolved) if found])
+    return frames
+
+def stackTakes(takes):
+    """
+    Stacks the detections of every camera of a take, up to the shortest recording.
+
+    Args:
+        takes: list of (points, valid) packed detection arrays, one per camera, see detectionFormat
+
+    Returns:
+        (frames, markers, cameras, 2) array of marker centers & (frames, markers, cameras) validity array
+    """
+    length = min(len(valid) for points, valid in takes)
+    points = np.stack([points[:length, :, 0] for points, valid in takes], axis=2)
+    valid = np.stack([valid[:length] for points, valid in takes], axis=2)
+    return points, valid
+
+def solveTake(takes, cameras):
+    """
+    Solve every frame recorded by all cameras of a take.
+
+    Args:
+        takes: list of (points, valid) packed detection arrays, one per camera, see detectionFormat
+        cameras: list of CameraModels or camera tuples, see sessionRays
+
+    Returns:
+        List in the form of solveFrame's results for each frame with the residual in place of the
+        distance, up to the shortest recording
+    """
+    return solvedFrames(*solveSession(*stackTakes(takes), cameras))
+
+def sharedArrays(memories, specs):
+    """Returns NumPy views of shared memory blocks laid out by (name, shape, dtype) specs."""
+    return [np.ndarray(shape, dtype=dtype, buffer=memory.buf) for memory, (name, shape, dtype) in zip(memories, specs)]
+
+def solveRange(specs, cameras, start, stop):
+    """
+    Solve worker task, solving frames start to stop of a take shared by solveParallel.
+
+    Args:
+        specs: (name, shape, dtype) of the shared points, valid, solved points, residuals and solved arrays
+        cameras: list of CameraModels or camera tuples, see sessionRays
+        start (int): first frame solved
+        stop (int): frame after the last frame solved
+    """
+    memories = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    shared = sharedArrays(memories, specs)
+    try:
+        results = solveSession(shared[0][start:stop], shared[1][start:stop], cameras)
+        for output, result in zip(shared[2:], results):
+            output[start:stop] = result
+    finally:
+        # Views have to be Released before the Memory is Closed
+        shared = None
+        for memory in memories:
+            memory.close()
+
+def solveParallel(takes, cameras, pool, processes):
+    """
+    Solve every frame recorded by all cameras of a take, split into contiguous frame ranges solved
+    by a pool of worker processes.
+
+    The stacked detections and the solved arrays live in shared memory, so workers read their
+    frames and write their results in place and only the cameras are pickled per range.
+
+    Args:
+        takes: list of (points, valid) packed detection arrays, one per camera, see detectionFormat
+        cameras: list of CameraModels or camera tuples, see sessionRays
+        pool: multiprocessing Pool the ranges are solved by
+        processes (int): number of the pool's processes, the frames are split in as many ranges
+
+    Returns:
+        see solveTake
+    """
+    points, valid = stackTakes(takes)
+    frames, markers = valid.shape[:2]
+    ranges = max(1, min(processes, frames // PARALLEL_FRAMES))
+    if ranges == 1:
+        return solvedFrames(*solveSession(points, valid, cameras))
+
+    layouts = [(points.shape, points.dtype), (valid.shape, valid.dtype), ((frames, markers, 3), np.dtype('float64')),
+               ((frames, markers), np.dtype('float64')), ((frames, markers), np.dtype('bool'))]
+    memories = [shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+                for shape, dtype in layouts]
+    specs = [(memory.name, shape, dtype.str) for memory, (shape, dtype) in zip(memories, layouts)]
+    shared = sharedArrays(memories, specs)
+    try:
+        shared[0][...], shared[1][...] = points, valid
+
+        bounds = np.linspace(0, frames, ranges + 1).astype(int)
+        pool.starmap(solveRange, [(specs, cameras, start, stop) for start, stop in zip(bounds[:-1], bounds[1:])])
+        return solvedFrames(*shared[2:])
+    finally:
+        shared = None
+        for memory in memories:
+            memory.close()
+            memory.unlink()
@@ -0,0 +1,78 @@
+"""Vectorized geometry for quadrangles stored as (N, 4, 2) corner arrays."""
+
+import numpy as np
+
+def asQuads(quads):
+    """Returns quadrangle corners as a float64 (N, 4, 2) NumPy array."""
+    return np.asarray(quads, dtype="float64").reshape(-1, 4, 2)
+
+def cross(u, v):
+    """Returns the z component of the cross product of stacked 2D vectors."""
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+def sideLengths(quads):
+    """Returns the (N, 4) side lengths ab, bc, cd, da of quadrangles with corners a, b, c, d."""
+    quads = asQuads(quads)
+    sides = np.roll(quads, -1, axis=1) - quads
+    return np.sqrt(np.sum(sides * sides, axis=2))
+
+def sideRatio(quads):
+    """Returns the ratio of the longer to the shorter of the first two sides of each quadrangle."""
+    lengths = sideLengths(quads)
+    ab, bc = lengths[:, 0], lengths[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.maximum(ab, bc) / np.minimum(ab, bc)
+
+def isSquareLike(quads, maxRatio=2):
+    """Returns a boolean mask of the quadrangles whose side ratio is likely a square's."""
+    return sideRatio(quads) < maxRatio
+
+def diagonalIntersection(quads):
+    """
+    Finds the center of quadrangles as the crossing point of their diagonals.
+
+    Args:
+        quads: (N, 4, 2) array of corners in clockwise order.
+
+    Returns:
+        (N, 2) float64 NumPy array of centers, NaN where the diagonals don't cross at a single point.
+    """
+    quads = asQuads(quads)
+    a, b, c, d = quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3]
+    ac = c - a
+    bd = d - b
+    ab = b - a
+
+    denominator = cross(ac, bd)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = cross(ab, bd) / denominator
+        u = cross(ab, ac) / denominator
+        centers = a + ac * t[:, None]
+    crossing = (denominator != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+
+    centers[~crossing] = np.nan
+    return centers
+
+def pointsInQuads(points, quads):
+    """
+    Tests which points lie strictly inside which convex quadrangles.
+
+    Args:
+        points: (M, 2) array of points.
+        quads: (N, 4, 2) array of corners in a consistent winding order.
+
+    Returns:
+        (N, M) boolean NumPy array, True where point m is inside quadrangle n.
+    """
+    points = np.asarray(points, dtype="float64").reshape(-1, 2)
+    quads = asQuads(quads)
+    edges = np.roll(quads, -1, axis=1) - quads
+    offsets = points[None, None, :, :] - quads[:, :, None, :]
+    sides = cross(edges[:, :, None, :], offsets)
+    return np.all(sides > 0, axis=1) | np.all(sides < 0, axis=1)
+
+def quadsContain(quads):
+    """Returns an (N, N) boolean matrix, True where quadrangle i contains every corner of quadrangle j."""
+    quads = asQuads(quads)
+    inside = pointsInQuads(quads.reshape(-1, 2), quads).reshape(len(quads), len(quads), 4)
+    return np.all(inside, axis=2)
@@ -0,0 +1,16 @@
+"""Pushing exported result files to the master down the capture session's own output channel."""
+
+import base64
+import zlib
+
+def encodePayload(path, level=6):
+    """Returns the contents of a file compressed and base64 encoded to fit on a single protocol line."""
+    with open(path, "rb") as data:
+        return base64.b64encode(zlib.compress(data.read(), level)).decode("ascii")
+
+def decodePayload(payload, path):
+    """Writes a file encoded by encodePayload to path, returning the number of bytes written."""
+    data = zlib.decompress(base64.b64decode(payload))
+    with open(path, "wb") as output:
+        output.write(data)
+    return len(data)
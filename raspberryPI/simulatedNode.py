@@ -0,0 +1,174 @@
+"""Simulated camera node rendering a known 3D marker scene, speaking the cameraController protocol."""
+
+import math
+import sys
+import multiprocessing
+import numpy as np
+import cv2
+import markerDetection as md
+import yuvConversion as yc
+import standInCamera as sc
+import cameraController as controller
+
+COLOR_BGR = {'red': (0, 0, 255), 'yellow': (0, 255, 255), 'green': (0, 255, 0),
+             'cyan': (255, 255, 0), 'blue': (255, 0, 0), 'magenta': (255, 0, 255)}
+
+# Scene of Markers Circling the Capture Volume, Looping Every SCENE_FRAMES Frames, Using the
+# Patterns the Detector Identifies in Every Color
+SCENE_FRAMES = 24
+SCENE_PATTERNS = ['triangle', 'square', 'slash', 'y']
+SCENE_MARKERS = [(md.COLOR_ID[i % 6], SCENE_PATTERNS[(i + i // 6) % 4]) for i in range(12)]
+MARKER_SIZE = 0.3
+
+# Cameras on a Ring Around the Volume, Aimed at its Center
+RING_RADIUS = 4.0
+RING_HEIGHT = 2.0
+TARGET = (0.0, 0.0, 1.0)
+
+# Angle of View of the Pi Camera v2 in Radians
+AOV = (1.0856, 0.8517)
+
+# Detection Workers per Node, Rigs are Simulated on a Single Machine
+WORKERS = 1
+
+def renderMarker(color, pattern, bitSize=16):
+    """Returns a BGR image of a marker with its pattern bits in the given color on black."""
+    bits = np.array(dict((name, array) for array, name in md.PATTERNS)[pattern], dtype="uint8")
+    marker = bits[:, :, None] * np.array(COLOR_BGR[color], dtype="uint8")
+    return cv2.resize(marker, (8 * bitSize, 8 * bitSize), interpolation=cv2.INTER_NEAREST)
+
+def markerPositions(frame):
+    """
+    Returns the ground truth of the scene at a recorded frame.
+
+    Args:
+        frame (int): index of the frame in the recording, the scene loops every SCENE_FRAMES.
+
+    Returns:
+        Dictionary of (x, y, z) marker positions in meters by "{color} {pattern}" label.
+    """
+    phase = 2 * math.pi * (frame % SCENE_FRAMES) / SCENE_FRAMES
+    positions = {}
+    for i, (color, pattern) in enumerate(SCENE_MARKERS):
+        radius = 0.4 + 0.8 * (i % 4) / 3
+        angle = phase * (1 if i % 2 else -1) + 2 * math.pi * i / len(SCENE_MARKERS)
+        height = 0.6 + (i % 3) * 0.5 + 0.1 * math.sin(phase + i)
+        positions["{} {}".format(color, pattern)] = (radius * math.cos(angle), radius * math.sin(angle), height)
+    return positions
+
+def rotationMatrix(rotation):
+    """Returns the matrix of XYZ euler angles, as used by the solver's camera rotations."""
+    x, y, z = rotation
+    rx = np.array([[1, 0, 0], [0, math.cos(x), -math.sin(x)], [0, math.sin(x), math.cos(x)]])
+    ry = np.array([[math.cos(y), 0, math.sin(y)], [0, 1, 0], [-math.sin(y), 0, math.cos(y)]])
+    rz = np.array([[math.cos(z), -math.sin(z), 0], [math.sin(z), math.cos(z), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+def cameraPose(index, count):
+    """
+    Returns the camera of a node on the ring, aimed at the center of the volume.
+
+    Args:
+        index (int): node index.
+        count (int): number of nodes on the ring.
+
+    Returns:
+        Camera tuple in the solver's form (posX, posY, posZ, rotX, rotY, rotZ, aovX, aovY).
+    """
+    angle = 2 * math.pi * index / count
+    origin = np.array([RING_RADIUS * math.cos(angle), RING_RADIUS * math.sin(angle), RING_HEIGHT])
+
+    # Cameras Look Down their -Z Axis with Y Up
+    forward = np.array(TARGET) - origin
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, (0, 0, 1))
+    right /= np.linalg.norm(right)
+    up = np.cross(right, forward)
+    m = np.stack((right, up, -forward), axis=1)
+
+    rotation = (math.atan2(m[2, 1], m[2, 2]), -math.asin(m[2, 0]), math.atan2(m[1, 0], m[0, 0]))
+    return tuple(origin) + rotation + AOV
+
+def projectPoint(camera, point, resolution):
+    """
+    Projects a point into a camera's frame, inverting the solver's angle of view model.
+
+    Args:
+        camera: camera tuple in the solver's form, see cameraPose.
+        point: (x, y, z) position in meters.
+        resolution: (width, height) of the frame.
+
+    Returns:
+        (x, y) pixel position and distance of the point, or None if it's behind the camera.
+    """
+    local = rotationMatrix(camera[3:6]).T @ (np.array(point) - np.array(camera[:3]))
+    distance = np.linalg.norm(local)
+    if local[2] >= 0:
+        return None
+    u = math.asin(local[0] / distance) / camera[6] + 0.5
+    v = math.atan2(local[1], -local[2]) / camera[7] + 0.5
+    return (u * resolution[0], v * resolution[1]), distance
+
+def renderFrame(camera, frame, resolution, seed=0):
+    """Returns a BGR frame of the scene at a recorded frame, seen by the camera."""
+    rng = np.random.default_rng(seed + frame)
+    image = np.full((resolution[1], resolution[0], 3), 235, dtype="uint8")
+    focal = resolution[0] / camera[6]
+
+    # Markers Face the Camera with a Quiet Zone of One Bit and are Painted Far to Near
+    projected = []
+    for label, position in markerPositions(frame).items():
+        projection = projectPoint(camera, position, resolution)
+        if projection is not None:
+            projected.append((projection[1], projection[0], label))
+    for distance, (x, y), label in sorted(projected, reverse=True):
+        side = int(MARKER_SIZE * focal / distance)
+        left, top = int(x - side / 2), int(y - side / 2)
+        if side < 8 or left < 0 or top < 0 or left + side > resolution[0] or top + side > resolution[1]:
+            continue
+        marker = cv2.copyMakeBorder(renderMarker(*label.split()), 16, 16, 16, 16, cv2.BORDER_CONSTANT, value=(235, 235, 235))
+        image[top:top + side, left:left + side] = cv2.resize(marker, (side, side), interpolation=cv2.INTER_AREA)
+
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    noise = rng.normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype("uint8")
+
+class SimulatedCamera(sc.StandInCamera):
+    """
+    Stand-in camera recording the simulated scene from a node's position on the ring.
+
+    A loop of SCENE_FRAMES frames is rendered once per resolution, before the recording starts.
+
+    Args:
+        index (int): node index.
+        count (int): number of nodes on the ring.
+    """
+    def __init__(self, index, count):
+        super().__init__()
+        self.camera = cameraPose(index, count)
+        self.rendered = {}
+
+    def frameBuffers(self):
+        resolution = tuple(self.resolution)
+        if resolution not in self.rendered:
+            self.rendered[resolution] = [yc.bgrToI420(renderFrame(self.camera, frame, resolution))
+                                         for frame in range(SCENE_FRAMES)]
+        return self.rendered[resolution]
+
+if __name__ == "__main__":
+    # simulatedNode.py index count [width height]
+    index, count = int(sys.argv[1]), int(sys.argv[2])
+    controller.HOST = "simulated{}".format(index)
+
+    workers = multiprocessing.Pool(WORKERS)
+    camera = SimulatedCamera(index, count)
+    if len(sys.argv) > 4:
+        camera.resolution = (int(sys.argv[3]), int(sys.argv[4]))
+    camera.frameBuffers()
+    print("Simulated Camera Ready : {}".format(index), file=sys.stderr, flush=True)
+    try:
+        controller.captureSession(camera, workers)
+    finally:
+        camera.close()
+        workers.close()
+        workers.join()
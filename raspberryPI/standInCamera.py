@@ -0,0 +1,65 @@
+"""Stand-in for picamera's PiCamera, recording prepared frames so captures run without a camera module."""
+
+import threading
+import time
+import numpy as np
+import frameStore as fs
+
+class StandInCamera(object):
+    """
+    Stand-in for picamera.PiCamera recording unencoded I420 frames at the configured frame rate.
+
+    Only the settings and recording methods used by the camera controllers are provided.
+
+    Args:
+        frames: list of padded I420 buffers at the recording resolution, played back in a loop.
+            A uniform gray frame is recorded by default.
+    """
+    def __init__(self, frames=None):
+        self.resolution = (1632, 1232)
+        self.framerate = 24
+        self.iso = 0
+        self.shutter_speed = 0
+        self.awb_mode = 'auto'
+        self.awb_gains = (1.0, 1.0)
+        self.frames = frames
+        self.recording = None
+
+    def start_recording(self, output, format=None):
+        if format != 'yuv':
+            raise ValueError("the stand-in camera only records unencoded 'yuv' output")
+        frames = self.frameBuffers()
+        if any(len(frame) != fs.frameSize(self.resolution) for frame in frames):
+            raise ValueError("stand-in frames don't match the resolution %dx%d" % tuple(self.resolution))
+
+        self.output = output
+        self.stopped = threading.Event()
+        self.recording = threading.Thread(target=self.record, args=(frames, self.framerate, self.stopped))
+        self.recording.start()
+
+    def frameBuffers(self):
+        """Returns the padded I420 frames recorded at the current resolution."""
+        if self.frames is None:
+            return [np.full(fs.frameSize(self.resolution), 128, dtype=np.uint8).tobytes()]
+        return self.frames
+
+    def record(self, frames, framerate, stopped):
+        """Writes the frames to the output on the frame rate's schedule until stopped."""
+        start = time.time()
+        index = 0
+        while not stopped.wait(max(0, start + index / framerate - time.time())):
+            self.output.write(frames[index % len(frames)])
+            index += 1
+
+    def wait_recording(self, timeout=0):
+        self.stopped.wait(timeout)
+
+    def stop_recording(self):
+        self.stopped.set()
+        self.recording.join()
+        self.recording = None
+        self.output.flush()
+
+    def close(self):
+        if self.recording is not None:
+            self.stop_recording()
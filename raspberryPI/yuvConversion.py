@@ -0,0 +1,109 @@
+"""Tools for converting the camera's unencoded I420 frame buffers."""
+
+import numpy as np
+import cv2
+
+# YUV conversion matrix from ITU-R BT.601 version (SDTV), rows ordered B, G, R
+#                        Y       U       V
+YUV_TO_BGR = np.array([[1.164,  2.017,  0.000],
+                       [1.164, -0.392, -0.813],
+                       [1.164,  0.000,  1.596]])
+YUV_BIAS = np.array([16, 128, 128])
+
+# Use openCV's Native I420 Conversion when Available
+NATIVE_I420 = hasattr(cv2, 'COLOR_YUV2BGR_I420')
+
+def rawResolution(resolution, splitter=False):
+    """
+    Round a (width, height) tuple up to the nearest multiple of 32 horizontally
+    and 16 vertically (as this is what the Pi's camera module does for
+    unencoded output).
+
+    Originally Written by Dave Jones as part of PiCamera
+    """
+    width, height = resolution
+    if splitter:
+        fwidth = (width + 15) & ~15
+    else:
+        fwidth = (width + 31) & ~31
+    fheight = (height + 15) & ~15
+    return fwidth, fheight
+
+def frameBuffer(data, resolution):
+    """Returns a zero-copy (fheight * 3/2, fwidth) uint8 view of a padded I420 buffer."""
+    fwidth, fheight = rawResolution(resolution)
+    a = np.frombuffer(data, dtype=np.uint8)
+    if len(a) != fwidth * fheight * 3 // 2:
+        raise ValueError('Incorrect buffer length for resolution %dx%d' % resolution)
+    return a.reshape((fheight * 3 // 2, fwidth))
+
+def planes(data, resolution):
+    """Returns zero-copy Y, U and V plane views of a padded I420 buffer cropped to the resolution."""
+    width, height = resolution
+    fwidth, fheight = rawResolution(resolution)
+    a = frameBuffer(data, resolution).reshape(-1)
+    y_len = fwidth * fheight
+    uv_len = (fwidth // 2) * (fheight // 2)
+    Y = a[:y_len].reshape((fheight, fwidth))[:height, :width]
+    U = a[y_len:y_len + uv_len].reshape((fheight // 2, fwidth // 2))[:(height + 1) // 2, :(width + 1) // 2]
+    V = a[y_len + uv_len:].reshape((fheight // 2, fwidth // 2))[:(height + 1) // 2, :(width + 1) // 2]
+    return Y, U, V
+
+def yuv2bgr(yuv):
+    """Returns an openCV BGR image from a (..., 3) YUV array using the BT.601 coefficients."""
+    bgr = (yuv.astype(float) - YUV_BIAS).dot(YUV_TO_BGR.T)
+    return bgr.clip(0, 255).astype(np.uint8)
+
+def nativeBgr(data, resolution):
+    """Converts a padded I420 buffer to an openCV BGR image with openCV's fixed point conversion."""
+    width, height = resolution
+    bgr = cv2.cvtColor(frameBuffer(data, resolution), cv2.COLOR_YUV2BGR_I420)
+    return bgr[:height, :width]
+
+def referenceBgr(data, resolution, rows=64):
+    """
+    Converts a padded I420 buffer to an openCV BGR image with the floating point BT.601 matrix.
+
+    Matches PiCamera's bytes2yuv and yuv2rgb conversion, processed in bands of rows to bound
+    the size of the floating point intermediates.
+    """
+    width, height = resolution
+    Y, U, V = planes(data, resolution)
+    bgr = np.empty((height, width, 3), dtype=np.uint8)
+    rows = rows & ~1
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        u = np.repeat(np.repeat(U[top // 2:(bottom + 1) // 2], 2, axis=0), 2, axis=1)
+        v = np.repeat(np.repeat(V[top // 2:(bottom + 1) // 2], 2, axis=0), 2, axis=1)
+        yuv = np.dstack((Y[top:bottom], u[:bottom - top, :width], v[:bottom - top, :width]))
+        bgr[top:bottom] = yuv2bgr(yuv)
+    return bgr
+
+def i420ToBgr(data, resolution, native=NATIVE_I420):
+    """
+    Converts a padded I420 camera buffer to an openCV BGR image.
+
+    Args:
+        data: bytes-like I420 buffer as written by the camera's 'yuv' output.
+        resolution: (width, height) of the recorded frames.
+        native (bool): use openCV's conversion, otherwise the floating point BT.601 fallback.
+
+    Returns:
+        openCV BGR image.
+    """
+    if native:
+        return nativeBgr(data, resolution)
+    return referenceBgr(data, resolution)
+
+def bgrToI420(frame):
+    """Returns a BGR frame as a padded I420 buffer, as written by the camera's 'yuv' output."""
+    height, width = frame.shape[:2]
+    fwidth, fheight = rawResolution((width, height))
+    i420 = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420)
+    Y = np.zeros((fheight, fwidth), dtype="uint8")
+    U = np.zeros((fheight // 2, fwidth // 2), dtype="uint8")
+    V = np.zeros((fheight // 2, fwidth // 2), dtype="uint8")
+    Y[:height, :width] = i420[:height]
+    U[:height // 2, :width // 2] = i420[height:height + height // 4].reshape(height // 2, width // 2)
+    V[:height // 2, :width // 2] = i420[height + height // 4:].reshape(height // 2, width // 2)
+    return Y.tobytes() + U.tobytes() + V.tobytes()